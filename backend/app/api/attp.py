@@ -1,11 +1,15 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+import orjson
 from pydantic import BaseModel
-from sqlalchemy.orm import Session, raiseload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from app.db import session
 from app.models.models import Features
-from app.services.features_service import get_all_features_by_city
+from app.services.features_service import find_features_by_city_async, get_features_page_async
+from app.core.cache import response_cache
+from app.core.profiling import profiled
+from app.services.pagination import page_response, ndjson_response, DEFAULT_LIMIT, MAX_LIMIT
 from app.schemas.feature import FeatureOut
 
 
@@ -13,23 +17,39 @@ router = APIRouter()
 
   
 @router.get("/indicators", response_class=ORJSONResponse)
-def get_indicators (city: str = Query(..., min_length=1), db_session: Session = Depends(session.get_db)):
-  print(city)
+@profiled("api_indicators")
+async def get_indicators (
+  city: str = Query(..., min_length=1),
+  threshold: float = Query(0.3, gt=0, le=1),
+  db_session: AsyncSession = Depends(session.get_async_db),
+):
+  cached = await response_cache.get_async(city, threshold)
+  if cached is not None:
+    return Response(cached, media_type="application/json")
   try:
-    results = get_all_features_by_city(db_session, city=city)
-    return results
+    results = await find_features_by_city_async(db_session, city=city, threshold=threshold)
   except Exception as e:
-    return {"status": "error", "detail": str(e)}
+    # lỗi DB trả 500 (không cache), không trả [] như thể thành phố không có dữ liệu
+    print(f"Error fetching features for city {city}: {e}")
+    raise HTTPException(status_code=500, detail="Internal server error")
+  body = orjson.dumps(results)
+  # gắn với các source trong kết quả: rebuild một source chỉ xoá các response liên quan
+  await response_cache.set_async(city, threshold, body, sorted({r["source"] for r in results}))
+  return Response(body, media_type="application/json")
 
 
 @router.get("/all", response_class=ORJSONResponse)
-def get_all_features(db_session: Session = Depends(session.get_db)):
+async def get_all_features(
+  after_id: int | None = Query(None, ge=0),
+  limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+  stream: bool = False,
+  db_session: AsyncSession = Depends(session.get_async_db),
+):
+  # stream=true: NDJSON toàn bộ bảng (từ after_id), đọc bằng server-side cursor
+  if stream:
+    return ndjson_response(Features, after_id=after_id)
   try:
-    rows = (
-      db_session.query(Features)
-        .options(raiseload("*"))  # không load bất kỳ relationship nào
-        .all()
-    )
-    return rows
+    rows, next_cursor = await get_features_page_async(db_session, after_id=after_id, limit=limit)
+    return page_response(rows, next_cursor)
   except Exception:
-    raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+    raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import session
-from app.services.log_service import get_ingest_logs
+from app.services.log_service import get_ingest_logs_async
 from app.services.log_raw_file import get_raw_file
+from app.models.models import IngestLogs
+from app.services.pagination import page_response, ndjson_response, DEFAULT_LIMIT, MAX_LIMIT
 
 router = APIRouter()
 
 @router.get("/ingest-logs")
-def fetch_ingest_logs(db: Session = Depends(session.get_db)):
+async def fetch_ingest_logs(
+  after_id: int | None = Query(None, ge=0),
+  limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+  stream: bool = False,
+  db: AsyncSession = Depends(session.get_async_db),
+):
+  if stream:
+    return ndjson_response(IngestLogs, after_id=after_id)
   try:
-    return get_ingest_logs(db)
+    return page_response(*await get_ingest_logs_async(db, after_id=after_id, limit=limit))
   except Exception as e:
     return {"status": "error", "detail": str(e)}
 
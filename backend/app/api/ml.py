@@ -1,15 +1,39 @@
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from app.db import session
-from app.ml.prediction import make_prediction
+from app.core.profiling import profiled
+from app.ml.prediction import make_prediction, make_batch_prediction, model_holder
+from app.schemas.prediction import BatchPredictionIn
 
 
 
 router = APIRouter()
 
 @router.get("/predict")
+@profiled("api_predict")
 def predict_features(city: str = Query(..., min_length=1), db_session: Session = Depends(session.get_db)):
   try:
     return make_prediction(city, db_session)
   except Exception as e:
-    return {"status": "error", "detail": str(e)}
\ No newline at end of file
+    return {"status": "error", "detail": str(e)}
+
+@router.post("/predict/batch")
+@profiled("api_predict_batch")
+def predict_features_batch(body: BatchPredictionIn, db_session: Session = Depends(session.get_db)):
+  try:
+    return make_batch_prediction(body.cities, db_session)
+  except Exception as e:
+    return {"status": "error", "detail": str(e)}
+
+@router.get("/model")
+def model_status():
+  return model_holder.status()
+
+@router.post("/reload")
+def reload_model(force: bool = False):
+  # gọi sau khi đăng ký version mới trong registry
+  try:
+    reloaded = model_holder.reload(force=force)
+    return {**model_holder.status(), "reloaded": reloaded}
+  except Exception as e:
+    return {"status": "error", "detail": str(e)}
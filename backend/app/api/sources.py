@@ -1,13 +1,22 @@
-from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Query
 from app.db import session
-from app.services.sources_services import get_all_sources
+from app.services.sources_services import get_all_sources_async
+from app.models.models import Sources
+from app.services.pagination import page_response, ndjson_response, DEFAULT_LIMIT, MAX_LIMIT
 
 router = APIRouter()
 
 @router.get("/all")
-def fetch_sources(db: Session = Depends(session.get_db)):
+async def fetch_sources(
+  after_id: int | None = Query(None, ge=0),
+  limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+  stream: bool = False,
+  db: AsyncSession = Depends(session.get_async_db),
+):
+  if stream:
+    return ndjson_response(Sources, after_id=after_id)
   try:
-    return get_all_sources(db)
+    return page_response(*await get_all_sources_async(db, after_id=after_id, limit=limit))
   except Exception as e:
     return {"status": "error", "detail": str(e)}
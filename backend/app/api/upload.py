@@ -1,14 +1,26 @@
 # app/api/upload.py
-from fastapi import APIRouter, UploadFile, File, Form, Depends
-import json
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
+import json, uuid
+from sqlalchemy.exc import IntegrityError
 from app.workers.tasks.pipeline_task import run_pipeline_chain
-from app.utils.minio_client import put_bytes, make_minio, ensure_bucket, md5_of_bytes, today_path
+from app.utils.minio_client import put_bytes, put_stream, move_object, make_minio, ensure_bucket, md5_of_bytes, today_path, HashingReader
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.db import session
 from app.services.sources_services import add_source
+from app.services.log_raw_file import log_raw_file, get_raw_file_by_checksum, get_raw_file_by_task_id, update_raw_file
+from app.services.feature_builds_service import build_state
 
 router = APIRouter()
 
+def _duplicate_response(raw_file):
+    return {"message": "duplicate", "raw_uri": raw_file.path, "config_uri": None, "task_id": raw_file.task_id}
+
+def _add_source_id(db: Session, **fields) -> int:
+    # đọc id ngay trong thread: sau commit object bị expire, đọc trên event loop sẽ query lại DB
+    return add_source(db, **fields).id
+
 @router.post("/data")
 async def upload_file(
     name: str = Form(""),
@@ -20,13 +32,40 @@ async def upload_file(
     config: UploadFile | None = File(None),
     source: str = Form("manual"),
     config_id: str | None = Form(None),
+    force: bool = Form(False),
     db: Session = Depends(session.get_db)
 ):
 
+    client = make_minio()
+    bucket = await run_in_threadpool(ensure_bucket, client, "pmnm")
+    content_type = data.content_type or "application/octet-stream"
+
+    raw_bytes = incoming_key = None
+    if settings.upload_streaming:
+        # stream file lên MinIO (multipart, trong threadpool) vào key tạm, vừa đọc vừa tính md5;
+        # không giữ cả file trong bộ nhớ và không chặn event loop
+        reader = HashingReader(data.file)
+        incoming_key = f"raw/{source}/{today_path()}/_incoming/{uuid.uuid4().hex}_{data.filename}"
+        await run_in_threadpool(put_stream, client, bucket, incoming_key, reader, content_type, settings.upload_part_size)
+        checksum_raw = reader.hexdigest()
+    else:
+        raw_bytes = await data.read()
+        checksum_raw = md5_of_bytes(raw_bytes)
+
+    async def drop_incoming():
+        if incoming_key:
+            await run_in_threadpool(client.remove_object, bucket, incoming_key)
+
+    # file đã ingest (chưa lỗi) -> trả lại task/URI cũ, không lưu và không chạy lại pipeline
+    # DB (session sync) và publish AMQP đều chặn -> chạy trong threadpool như MinIO
+    existing = await run_in_threadpool(get_raw_file_by_checksum, db, checksum_raw)
+    if existing is not None and existing.status != "failed" and not force:
+        await drop_incoming()
+        return _duplicate_response(existing)
+
     # save source metadata
-    add_source(db, name=name, url=url, kind=kind, owner=source, license=license, update_frequency=update_frequency)
+    source_id = await run_in_threadpool(_add_source_id, db, name=name, url=url, kind=kind, owner=source, license=license, update_frequency=update_frequency)
 
-    raw_bytes = await data.read()
     cfg_bytes = None
 
     # cấu hình: ưu tiên file cấu hình kèm theo; nếu không có thì dùng config_id
@@ -38,17 +77,51 @@ async def upload_file(
         cfg = None
         cfg_uri = f"s3://pmnm/configs/{config_id}.json" if config_id else None
 
-    client = make_minio()
-    checksum_raw = md5_of_bytes(raw_bytes)
-    key = f"raw/{source}/{today_path()}/{checksum_raw}_{data.filename}"
-    
-    # push file raw lên MinIO (như bạn đã làm), trả về raw_uri
-    raw_uri = put_bytes(client, bucket=ensure_bucket(client, "pmnm"), key=key, data=raw_bytes, content_type=data.content_type or "application/octet-stream")
-
-    # nếu có file cấu hình kèm theo thì cũng lưu lại để trace
-    if cfg and not cfg_uri and cfg_bytes:
-        cfg_uri = put_bytes(client, bucket="pmnm", key=f"configs/{source}/{config.filename}", data=cfg_bytes, content_type="application/json")
-
-    # chạy pipeline, truyền cả raw_uri và config (hoặc config_uri)
-    task = run_pipeline_chain(raw_uri, source, cfg, cfg_uri)
+    if existing is not None:
+        # chạy lại (force hoặc lần trước lỗi) trên file raw đã lưu
+        await drop_incoming()
+        raw_uri = existing.path
+        raw_file = await run_in_threadpool(update_raw_file, db, existing, status="new", task_id=None)
+    else:
+        key = f"raw/{source}/{today_path()}/{checksum_raw}_{data.filename}"
+        try:
+            # giữ checksum trước khi lưu; upload trùng đồng thời sẽ vi phạm checksum_unique
+            raw_file = await run_in_threadpool(log_raw_file, db, source_id=source_id, bucket=bucket, key=key, checksum=checksum_raw)
+        except IntegrityError:
+            await drop_incoming()
+            return _duplicate_response(await run_in_threadpool(get_raw_file_by_checksum, db, checksum_raw))
+
+    try:
+        if existing is None and incoming_key:
+            # đã biết checksum -> chuyển object tạm sang key chính thức (copy phía server)
+            raw_uri = await run_in_threadpool(move_object, client, bucket, incoming_key, key)
+        elif existing is None:
+            # push file raw lên MinIO (như bạn đã làm), trả về raw_uri
+            raw_uri = await run_in_threadpool(put_bytes, client, bucket, key, raw_bytes, content_type)
+
+        # nếu có file cấu hình kèm theo thì cũng lưu lại để trace
+        if cfg and not cfg_uri and cfg_bytes:
+            cfg_uri = await run_in_threadpool(put_bytes, client, "pmnm", f"configs/{source}/{config.filename}", cfg_bytes, "application/json")
+
+        # chạy pipeline, truyền cả raw_uri và config (hoặc config_uri)
+        task = await run_in_threadpool(run_pipeline_chain, raw_uri, source, cfg, cfg_uri)
+    except Exception:
+        # không giữ checksum cho một lần upload chưa vào được pipeline
+        await run_in_threadpool(update_raw_file, db, raw_file, status="failed")
+        raise
+    await run_in_threadpool(update_raw_file, db, raw_file, task_id=task.id)
     return {"message":"queued", "raw_uri": raw_uri, "config_uri": cfg_uri, "task_id": task.id}
+
+@router.get("/task/{task_id}")
+def upload_task_status(task_id: str, db: Session = Depends(session.get_db)):
+    # task_id trả về từ /upload/data -> file raw và task rebuild (đã debounce) sẽ/đã build file đó
+    raw_file = get_raw_file_by_task_id(db, task_id)
+    if raw_file is None:
+        raise HTTPException(status_code=404, detail="task not found")
+    return {
+        "raw_uri": raw_file.path,
+        "status": raw_file.status,
+        "task_id": raw_file.task_id,
+        "build_task_id": raw_file.build_task_id,
+        "build_status": build_state(db, raw_file.build_task_id) if raw_file.build_task_id else None,
+    }
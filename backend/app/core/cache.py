@@ -0,0 +1,156 @@
+import asyncio, threading, time
+from collections import OrderedDict
+from app.core.config import settings
+
+
+class LRUCacheBackend:
+  # cache trong process: LRU + TTL, mỗi key gắn với các tag (source) để xoá theo source
+  def __init__(self, maxsize: int = 2048, ttl: float = 300):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._entries: OrderedDict[str, tuple[float, bytes, tuple[str, ...]]] = OrderedDict()
+    self._tags: dict[str, set[str]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, key: str) -> bytes | None:
+    with self._lock:
+      hit = self._entries.get(key)
+      if hit is None:
+        return None
+      if hit[0] <= time.monotonic():
+        self._drop(key)
+        return None
+      self._entries.move_to_end(key)
+      return hit[1]
+
+  def get_many(self, keys: list[str]) -> list[bytes | None]:
+    return [self.get(key) for key in keys]
+
+  def set(self, key: str, value: bytes, tags: list[str]):
+    with self._lock:
+      self._drop(key)
+      self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+      for tag in tags:
+        self._tags.setdefault(tag, set()).add(key)
+      while len(self._entries) > self.maxsize:
+        self._drop(next(iter(self._entries)))
+
+  def invalidate_tag(self, tag: str):
+    with self._lock:
+      for key in list(self._tags.get(tag, ())):
+        self._drop(key)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._tags.clear()
+
+  def _drop(self, key: str):
+    hit = self._entries.pop(key, None)
+    if hit is None:
+      return
+    for tag in hit[2]:
+      keys = self._tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self._tags[tag]
+
+
+class RedisCacheBackend:
+  # dùng chung giữa API và worker: worker rebuild features thì xoá được cache của API
+  # client: redis.Redis (hoặc fakeredis). Danh sách key / tag là sorted set với score = thời điểm hết hạn:
+  # mỗi lần ghi bỏ các phần tử đã hết hạn, bản thân set cũng hết hạn -> không phình theo thời gian
+  def __init__(self, client, ttl: float = 300, prefix: str = "attp:"):
+    self.client = client
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def _tag_key(self, tag: str) -> str:
+    return f"{self.prefix}tag:{tag}"
+
+  def get(self, key: str) -> bytes | None:
+    return self.client.get(self.prefix + key)
+
+  def get_many(self, keys: list[str]) -> list[bytes | None]:
+    return self.client.mget([self.prefix + key for key in keys]) if keys else []
+
+  def _track(self, pipe, index: str, member: str, expires: float, now: float):
+    pipe.zadd(index, {member: expires})
+    pipe.zremrangebyscore(index, "-inf", now)
+    pipe.expire(index, int(self.ttl) + 1)
+
+  def set(self, key: str, value: bytes, tags: list[str]):
+    key = self.prefix + key
+    now = time.time()
+    expires = now + self.ttl
+    pipe = self.client.pipeline(transaction=False)
+    pipe.set(key, value, ex=int(self.ttl))
+    self._track(pipe, f"{self.prefix}keys", key, expires, now)
+    for tag in tags:
+      self._track(pipe, f"{self.prefix}tags", tag, expires, now)
+      self._track(pipe, self._tag_key(tag), key, expires, now)
+    pipe.execute()
+
+  def invalidate_tag(self, tag: str):
+    keys = self.client.zrange(self._tag_key(tag), 0, -1)
+    self.client.delete(self._tag_key(tag), *keys)
+
+  def clear(self):
+    tags = [self._tag_key(t.decode() if isinstance(t, bytes) else t) for t in self.client.zrange(f"{self.prefix}tags", 0, -1)]
+    keys = self.client.zrange(f"{self.prefix}keys", 0, -1)
+    self.client.delete(f"{self.prefix}keys", f"{self.prefix}tags", *tags, *keys)
+
+
+class ResponseCache:
+  # response đã serialize (orjson bytes) theo (thành phố đã chuẩn hoá, threshold)
+  def __init__(self, backend):
+    self.backend = backend
+
+  @staticmethod
+  def key(city: str, threshold: float) -> str:
+    city = " ".join(city.split()).lower()
+    return f"indicators:{float(threshold)}:{city}"
+
+  def get(self, city: str, threshold: float) -> bytes | None:
+    try:
+      return self.backend.get(self.key(city, threshold))
+    except Exception as e:
+      # cache lỗi thì đọc thẳng DB, không làm hỏng request
+      print(f"Error reading response cache: {e}")
+      return None
+
+  def set(self, city: str, threshold: float, body: bytes, sources: list[str]):
+    try:
+      self.backend.set(self.key(city, threshold), body, sources)
+    except Exception as e:
+      print(f"Error writing response cache: {e}")
+
+  # route async: client Redis là sync -> chạy trong thread, không chặn event loop
+  async def get_async(self, city: str, threshold: float) -> bytes | None:
+    return await asyncio.to_thread(self.get, city, threshold)
+
+  async def set_async(self, city: str, threshold: float, body: bytes, sources: list[str]):
+    await asyncio.to_thread(self.set, city, threshold, body, sources)
+
+  def invalidate(self, source: str | None = None, new: bool = False):
+    # source mới có thể khớp với các thành phố đã cache (kể cả kết quả rỗng) -> xoá toàn bộ
+    if source is None or new:
+      self.backend.clear()
+    else:
+      self.backend.invalidate_tag(source)
+
+
+def make_cache_backend(prefix: str = "attp:", maxsize: int | None = None, ttl: float | None = None):
+  # không có CACHE_URL: LRU trong từng process -> worker không xoá được cache của API,
+  # dữ liệu có thể cũ tối đa ttl giây sau khi rebuild features
+  ttl = settings.cache_ttl if ttl is None else ttl
+  if settings.cache_url:
+    import redis  # chỉ cần khi dùng CACHE_URL
+    client = redis.Redis.from_url(settings.cache_url, socket_timeout=settings.cache_timeout,
+                                  socket_connect_timeout=settings.cache_timeout)
+    return RedisCacheBackend(client, ttl=ttl, prefix=prefix)
+  return LRUCacheBackend(maxsize=maxsize or settings.cache_size, ttl=ttl)
+
+
+response_cache = ResponseCache(make_cache_backend())
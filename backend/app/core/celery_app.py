@@ -1,13 +1,51 @@
 # app/tasks/celery_app.py
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 celery = Celery("pmnm", broker=os.getenv("CELERY_BROKER_URL"), backend=os.getenv("CELERY_RESULT_BACKEND", "rpc://"))
 
 celery.conf.update(
     broker_connection_retry_on_startup=True,  # tránh warning, retry ngay khi khởi động
+    # queue riêng: rebuild features lớn không chặn việc clean các upload khác
+    task_routes={
+        "clean_data": {"queue": "clean"},
+        "request_build_features": {"queue": "clean"},
+        "build_features": {"queue": "features"},
+    },
+    # task chạy lâu: mỗi process chỉ giữ một task, ack sau khi xong -> worker chết thì task được giao lại
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    task_annotations={
+        "clean_data": {
+            "soft_time_limit": int(os.getenv("CLEAN_SOFT_TIME_LIMIT", 15 * 60)),
+            "time_limit": int(os.getenv("CLEAN_TIME_LIMIT", 20 * 60)),
+        },
+        "build_features": {
+            "soft_time_limit": int(os.getenv("FEATURES_SOFT_TIME_LIMIT", 60 * 60)),
+            "time_limit": int(os.getenv("FEATURES_TIME_LIMIT", 65 * 60)),
+        },
+    },
+    result_expires=int(os.getenv("CELERY_RESULT_EXPIRES", 24 * 60 * 60)),
 )
 
 celery.conf.imports = [
   "app.workers.tasks.clean_data_task",
   "app.workers.tasks.build_features_task",
-]
\ No newline at end of file
+]
+
+
+# /metrics của worker: METRICS_PORT > 0 thì mở HTTP server trong process chính;
+# với --pool=prefork cần thêm PROMETHEUS_MULTIPROC_DIR để thấy số liệu của các process con
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    port = int(os.getenv("METRICS_PORT", "0"))
+    if port:
+        from app.core.metrics import serve
+        serve(port)
+
+
+@worker_process_shutdown.connect
+def drop_process_metrics(pid=None, **kwargs):
+    from app.core.metrics import mark_process_dead
+    mark_process_dead(pid or os.getpid())
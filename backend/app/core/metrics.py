@@ -0,0 +1,127 @@
+import os, threading, time
+from contextlib import contextmanager
+from prometheus_client import (
+  CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, start_http_server,
+)
+
+# Worker prefork: mỗi process con có metric riêng -> đặt PROMETHEUS_MULTIPROC_DIR (thư mục rỗng, ghi được)
+# để prometheus_client gom số liệu của mọi process khi xuất /metrics
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+HTTP_LATENCY = Histogram(
+  "http_request_duration_seconds", "Thời gian xử lý request theo route",
+  ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+  "pipeline_stage_duration_seconds", "Thời gian từng bước của clean/build features (mỗi lần chạy một observation)",
+  ["service", "stage"],
+  buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+PIPELINE_RUNS = Counter("pipeline_runs_total", "Số lần chạy clean/build features", ["service", "status"])
+ROWS_PROCESSED = Counter("pipeline_rows_processed_total", "Số dòng đã xử lý", ["service", "kind"])
+MINIO_BYTES_READ = Counter("minio_bytes_read_total", "Số byte đọc từ MinIO", ["bucket"])
+INFERENCE_SECONDS = Histogram(
+  "model_inference_duration_seconds", "Thời gian model.predict (không gồm truy vấn lag)",
+  ["kind"],
+  buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class StageTimer:
+  # cộng dồn thời gian từng bước trong một lần chạy (có thể gọi từ nhiều thread), observe một lần ở cuối
+  def __init__(self, service: str):
+    self.service = service
+    self.seconds: dict[str, float] = {}
+    self._lock = threading.Lock()
+
+  def add(self, stage: str, seconds: float):
+    with self._lock:
+      self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+  @contextmanager
+  def stage(self, name: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(name, time.perf_counter() - start)
+
+  def rows(self, kind: str, n: int):
+    ROWS_PROCESSED.labels(self.service, kind).inc(n)
+
+  def observe(self, status: str = "ok"):
+    for name, seconds in self.seconds.items():
+      STAGE_SECONDS.labels(self.service, name).observe(seconds)
+    PIPELINE_RUNS.labels(self.service, status).inc()
+
+  def summary(self) -> str:
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.seconds.items())
+
+
+@contextmanager
+def stage_timer(service: str):
+  # with stage_timer("clean") as stages: with stages.stage("parse"): ...
+  stages = StageTimer(service)
+  try:
+    yield stages
+  except BaseException:
+    stages.observe("failed")
+    raise
+  stages.observe()
+
+
+def record_minio_read(bucket: str, n: int):
+  MINIO_BYTES_READ.labels(bucket).inc(n)
+
+
+def observe_inference(kind: str, seconds: float):
+  INFERENCE_SECONDS.labels(kind).observe(seconds)
+
+
+def _registry():
+  if MULTIPROC_DIR:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+  return REGISTRY
+
+
+def render() -> tuple[bytes, str]:
+  return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port: int):
+  # HTTP server riêng (thread) cho process không có FastAPI, vd. Celery worker
+  start_http_server(port, registry=_registry())
+
+
+def mark_process_dead(pid: int):
+  if MULTIPROC_DIR:
+    multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+  # ASGI middleware: đo tới khi gửi xong body (kể cả response stream NDJSON), nhãn route là path template
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      return await self.app(scope, receive, send)
+    start = time.perf_counter()
+    status = 500
+
+    async def send_wrapper(message):
+      nonlocal status
+      if message["type"] == "http.response.start":
+        status = message["status"]
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_wrapper)
+    finally:
+      route = scope.get("route")
+      # path không khớp route nào -> gom chung một nhãn, tránh bùng nổ số series
+      path = getattr(route, "path", None) or "unmatched"
+      if path != "/metrics":
+        HTTP_LATENCY.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,140 @@
+import asyncio, cProfile, functools, inspect, io, marshal, pstats, random, threading, time, tracemalloc, uuid
+import datetime as dt
+from app.core.config import settings
+
+# mỗi thread chỉ một profiler (cProfile lồng nhau sẽ ghi đè nhau) -> lời gọi lồng bên trong chạy bình thường
+_active = threading.local()
+
+
+def _targets() -> set[str]:
+  return {t.strip() for t in settings.profile_targets.split(",") if t.strip()}
+
+
+def should_profile(name: str) -> bool:
+  if not settings.profile_enabled or getattr(_active, "on", False):
+    return False
+  targets = _targets()
+  if "*" not in targets and name not in targets:
+    return False
+  return random.random() < settings.profile_sample_rate
+
+
+class ProfileRun:
+  # cProfile chỉ thấy thread gọi (không thấy ThreadPoolExecutor bên trong); tracemalloc thấy mọi thread
+  def __init__(self, name: str):
+    self.name = name
+    self.profiler = cProfile.Profile()
+    # tracemalloc đang bật ở chỗ khác thì không start/stop thay cho họ
+    self.trace_memory = settings.profile_memory and not tracemalloc.is_tracing()
+    self.peak = self.snapshot = None
+    self.seconds = 0.0
+
+  def start(self):
+    _active.on = True
+    if self.trace_memory:
+      tracemalloc.start(25)
+    self._start = time.perf_counter()
+    self.profiler.enable()
+
+  def stop(self):
+    self.profiler.disable()
+    self.seconds = time.perf_counter() - self._start
+    _active.on = False
+    if self.trace_memory:
+      self.peak = tracemalloc.get_traced_memory()[1]
+      self.snapshot = tracemalloc.take_snapshot()
+      tracemalloc.stop()
+
+  def report(self, status: str) -> str:
+    out = io.StringIO()
+    out.write(f"{self.name}: {status}, {self.seconds:.3f}s")
+    if self.peak is not None:
+      out.write(f", peak {self.peak / 2**20:.1f} MiB")
+    out.write("\n\n== cProfile (cumulative) ==\n")
+    pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(settings.profile_top)
+    if self.snapshot is not None:
+      out.write("== tracemalloc: top allocations còn giữ lúc kết thúc ==\n")
+      for stat in self.snapshot.statistics("lineno")[:settings.profile_top]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+  def save(self, status: str) -> str:
+    from app.utils.minio_client import make_minio, put_bytes, today_path
+    from app.services.log_service import log_ingest
+    from app.db.session import SessionLocal
+
+    self.profiler.create_stats()
+    base = f"profiles/{self.name}/{today_path()}/{dt.datetime.utcnow():%H%M%S}_{uuid.uuid4().hex[:8]}"
+    client = make_minio()
+    # .prof: định dạng của pstats (python -m pstats / snakeviz), .txt: bản tóm tắt đọc được ngay
+    prof_uri = put_bytes(client, settings.minio_bucket, f"{base}.prof", marshal.dumps(self.profiler.stats))
+    put_bytes(client, settings.minio_bucket, f"{base}.txt", self.report(status).encode("utf-8"), "text/plain; charset=utf-8")
+
+    peak = f", peak {self.peak / 2**20:.1f} MiB" if self.peak is not None else ""
+    db = SessionLocal()
+    try:
+      log_ingest(db, source_key="Profiling", log=f"Profile {self.name} ({status}, {self.seconds:.2f}s{peak}): {prof_uri}")
+    finally:
+      db.close()
+    return prof_uri
+
+  def finish(self, status: str | None):
+    # lỗi khi lưu profile không được làm hỏng task / request
+    if status is None:
+      return
+    try:
+      self.save(status)
+    except Exception as e:
+      print(f"Không lưu được profile {self.name}: {e}")
+
+
+def _status(e: BaseException | None) -> str:
+  return "ok" if e is None else f"failed ({type(e).__name__})"
+
+
+def profiled(name: str, ignore: tuple = ()):
+  # bật bằng PROFILE_ENABLED + PROFILE_TARGETS, lấy mẫu theo PROFILE_SAMPLE_RATE;
+  # exception thuộc ignore (vd. celery Retry) thì bỏ profile của lần chạy đó
+  def decorate(fn):
+    if inspect.iscoroutinefunction(fn):
+      @functools.wraps(fn)
+      async def async_wrapper(*args, **kwargs):
+        if not should_profile(name):
+          return await fn(*args, **kwargs)
+        # route async: profiler bật trên thread của event loop, gồm cả các request khác chạy xen kẽ
+        run, status = ProfileRun(name), None
+        run.start()
+        try:
+          result = await fn(*args, **kwargs)
+          status = _status(None)
+          return result
+        except ignore:
+          raise
+        except BaseException as e:
+          status = _status(e)
+          raise
+        finally:
+          run.stop()
+          await asyncio.to_thread(run.finish, status)
+      return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if not should_profile(name):
+        return fn(*args, **kwargs)
+      run, status = ProfileRun(name), None
+      run.start()
+      try:
+        result = fn(*args, **kwargs)
+        status = _status(None)
+        return result
+      except ignore:
+        raise
+      except BaseException as e:
+        status = _status(e)
+        raise
+      finally:
+        run.stop()
+        run.finish(status)
+    return wrapper
+  return decorate
@@ -1,12 +1,32 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..core.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+pool_options = dict(
+  pool_size=settings.db_pool_size,
+  max_overflow=settings.db_max_overflow,
+  pool_pre_ping=settings.db_pool_pre_ping,
+  pool_recycle=settings.db_pool_recycle,
+)
+
+engine = create_engine(settings.DATABASE_URL, **pool_options)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def async_database_url(url: str) -> str:
+  # psycopg 3 dùng chung một driver cho sync và async; postgresql:// mặc định là psycopg2
+  for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+    if url.startswith(prefix):
+      return "postgresql+psycopg://" + url[len(prefix):]
+  return url
+
+# engine async cho các endpoint đọc: không chiếm thread của threadpool trong lúc chờ DB
+async_engine = create_async_engine(async_database_url(settings.DATABASE_URL), **pool_options)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession)
+
 Base = declarative_base()
 
 def get_db():
@@ -14,4 +34,8 @@ def get_db():
   try:
     yield db
   finally:
-    db.close()
\ No newline at end of file
+    db.close()
+
+async def get_async_db():
+  async with AsyncSessionLocal() as db:
+    yield db
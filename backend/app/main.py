@@ -1,8 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from app.core.metrics import MetricsMiddleware, render
 from app.db.session import engine, Base
 
 from .api import attp, upload, ml, logs, sources
+from .ml.prediction import model_holder
 
 Base.metadata.create_all(bind=engine)
 
@@ -13,13 +15,35 @@ origins = [
     "http://127.0.0.1:3000",
 ]
 
+@app.on_event("startup")
+def warm_up_model():
+    # load model ở background để API lên ngay, không chờ MLflow
+    model_holder.warm_up()
+    model_holder.start_polling()
+
+
+@app.on_event("shutdown")
+def stop_model_polling():
+    model_holder.stop_polling()
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+    # cursor trang sau của các endpoint danh sách (xem pagination.page_response): trình duyệt chỉ đọc được header đã expose
+    expose_headers=["X-Next-Cursor"],
 )
+# thêm sau CORS -> nằm ngoài cùng, đo cả thời gian của các middleware khác
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
 
 
 app.include_router(ml.router, prefix="/ml", tags=["ml"])
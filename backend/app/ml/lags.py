@@ -0,0 +1,39 @@
+import pandas as pd
+
+FEATURE_COLUMNS = [
+    'attp_cert_issued_count',
+    'attp_valid_count',
+    'processing_time_p50',
+    'processing_time_p90',
+    'facility_count',
+    'certified_facility_rate'
+]
+
+LAG_STEPS = [1, 2, 3]
+
+TARGET_COLUMN = "certified_facility_rate"
+
+
+def feature_names() -> list[str]:
+    return [f"{col}_lag{lag}" for col in FEATURE_COLUMNS for lag in LAG_STEPS]
+
+
+def build_lag_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # Mỗi (source, period_month) một dòng: lag k = giá trị của tháng thứ k tính lùi từ tháng đó (lag1 = chính tháng đó),
+    # tức là input để dự đoán tháng kế tiếp. Tháng chưa đủ len(LAG_STEPS) tháng lịch sử bị bỏ.
+    df = df.assign(_month=pd.to_datetime(df["period_month"], errors="coerce"))
+    # tháng không xác định (NaT) không thuộc chuỗi thời gian
+    df = df.dropna(subset=["_month"]).sort_values(["source", "_month"])
+    g = df.groupby("source")
+    lags = df[["source", "period_month"]].copy()
+    for col in FEATURE_COLUMNS:
+        for lag in LAG_STEPS:
+            lags[f"{col}_lag{lag}"] = g[col].shift(lag - 1)
+    return lags.dropna(subset=feature_names()).reset_index(drop=True)
+
+
+def training_frame(lags: pd.DataFrame) -> pd.DataFrame:
+    # target của một dòng = tỉ lệ của tháng kế tiếp, chính là {TARGET}_lag1 của dòng sau cùng source
+    lags = lags.assign(_month=pd.to_datetime(lags["period_month"], errors="coerce")).sort_values(["source", "_month"])
+    lags[TARGET_COLUMN] = lags.groupby("source")[f"{TARGET_COLUMN}_lag1"].shift(-1)
+    return lags.dropna(subset=[TARGET_COLUMN]).drop(columns="_month").reset_index(drop=True)
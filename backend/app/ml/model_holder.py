@@ -0,0 +1,120 @@
+import threading, warnings, mlflow
+from mlflow import MlflowClient
+from app.ml.forest import BatchSizedForest, CompiledForest
+
+
+class ModelHolder:
+    # Giữ model đang phục vụ: load lazy ở lần dùng đầu, cache URI đã resolve,
+    # reload khi registry có version mới (polling hoặc gọi reload())
+    def __init__(self, name: str, version: str | None = None, stage: str | None = None, poll_interval: float = 0, compiled: bool = True,
+                 compiled_max_rows: int = 256):
+        self.name = name
+        self.version = version
+        self.stage = stage
+        self.poll_interval = poll_interval
+        self.compiled = compiled
+        self.compiled_max_rows = compiled_max_rows
+        self.model = None
+        self.engine: str | None = None
+        self.uri: str | None = None
+        self.last_error: str | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller: threading.Thread | None = None
+
+    def resolve_uri(self) -> str:
+        # Nếu có version cụ thể
+        if self.version:
+            return f"models:/{self.name}/{self.version}"
+
+        client = MlflowClient()
+        # Nếu có stage/alias (Production/Staging) -> đổi ra version cụ thể để biết khi alias chuyển sang version khác
+        if self.stage:
+            mv = client.get_model_version_by_alias(self.name, self.stage)
+            return f"models:/{mv.name}/{mv.version}"
+
+        # Không có cả hai -> lấy version mới nhất đang có
+        vers = client.search_model_versions(f"name='{self.name}'")
+        if not vers:
+            raise RuntimeError(f"Model '{self.name}' chưa được đăng ký trong registry tại {mlflow.get_tracking_uri()}")
+        # sort theo version số
+        latest = max(vers, key=lambda v: int(v.version))
+        return f"models:/{latest.name}/{latest.version}"
+
+    def _load(self, uri: str):
+        print(f"[MLflow] tracking_uri = {mlflow.get_tracking_uri()}")
+        print(f"[MLflow] loading model: {uri}")
+        # Có thể bỏ filterwarnings nếu bạn muốn thấy cảnh báo mismatch để xử lý sau
+        warnings.filterwarnings("ignore")
+        model = mlflow.pyfunc.load_model(uri)
+        if self.compiled:
+            # rừng cây sklearn -> CompiledForest: predict không qua pyfunc/DataFrame/joblib;
+            # batch lớn hơn compiled_max_rows dòng vẫn dùng sklearn (nhanh hơn ở kích thước đó)
+            try:
+                forest = model.get_raw_model()
+                return BatchSizedForest(CompiledForest.from_sklearn(forest), forest, self.compiled_max_rows)
+            except Exception as e:
+                print(f"[MLflow] dùng pyfunc, không compile được model: {e}")
+        return model
+
+    def get(self):
+        model, uri = self.model, self.uri
+        if model is not None:
+            return model, uri
+        with self._lock:
+            if self.model is None:
+                try:
+                    uri = self.resolve_uri()
+                    self.model, self.uri, self.last_error = self._load(uri), uri, None
+                    self.engine = self._engine(self.model)
+                except Exception as e:
+                    self.last_error = str(e)
+                    raise RuntimeError(f"Failed to load model: {e}") from e
+            return self.model, self.uri
+
+    def reload(self, force: bool = False) -> bool:
+        # load model mới ngoài lock rồi mới đổi -> request đang chạy vẫn dùng model cũ
+        uri = self.resolve_uri()
+        if uri == self.uri and self.model is not None and not force:
+            return False
+        model = self._load(uri)
+        with self._lock:
+            self.model, self.uri, self.last_error = model, uri, None
+            self.engine = self._engine(model)
+        return True
+
+    @staticmethod
+    def _engine(model) -> str:
+        if isinstance(model, BatchSizedForest):
+            return f"compiled (<= {model.max_rows} dòng), sklearn" if model.max_rows > 0 else "compiled"
+        return "compiled" if isinstance(model, CompiledForest) else "pyfunc"
+
+    def warm_up(self) -> threading.Thread:
+        def run():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"[MLflow] warm-up failed: {e}")
+        t = threading.Thread(target=run, name="model-warmup", daemon=True)
+        t.start()
+        return t
+
+    def start_polling(self):
+        if self.poll_interval <= 0 or self._poller is not None:
+            return
+
+        def poll():
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    if self.reload():
+                        print(f"[MLflow] reloaded model: {self.uri}")
+                except Exception as e:
+                    print(f"[MLflow] reload failed: {e}")
+        self._poller = threading.Thread(target=poll, name="model-poller", daemon=True)
+        self._poller.start()
+
+    def stop_polling(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        return {"model_name": self.name, "model_uri": self.uri, "loaded": self.model is not None, "engine": self.engine, "error": self.last_error}
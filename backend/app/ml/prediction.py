@@ -1,20 +1,12 @@
-import warnings, mlflow, pandas as pd
-from app.services.features_service import get_all_features_by_city
+import mlflow, pandas as pd
+from app.services.features_service import get_features_by_sources, get_latest_lags
+from app.ml.lags import LAG_STEPS, feature_names, build_lag_frame
+from app.services.city_resolver import city_resolver
 from sqlalchemy.orm import Session
 import numpy as np
-import os
-from mlflow import MlflowClient
-
-FEATURE_COLUMNS = [
-    'attp_cert_issued_count',
-    'attp_valid_count',
-    'processing_time_p50',
-    'processing_time_p90',
-    'facility_count',
-    'certified_facility_rate'
-]
-
-LAG_STEPS = [1, 2, 3]
+import os, time
+from app.core.metrics import observe_inference
+from app.ml.model_holder import ModelHolder
 
 MODEL_NAME   = os.getenv("MODEL_NAME", "attp_facility_rate_prediction")
 MODEL_STAGE  = os.getenv("MODEL_STAGE")
@@ -22,121 +14,105 @@ MODEL_VER    = os.getenv("MODEL_VERSION")
 TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "file:///app/mlruns")  # cho container
 mlflow.set_tracking_uri(TRACKING_URI)
 
-def resolve_model_uri():
-
-    client = MlflowClient()
-
-    # Nếu có version cụ thể
-    if MODEL_VER:
-        return f"models:/{MODEL_NAME}/{MODEL_VER}"
-
-    # Nếu có stage (Production/Staging)
-    if MODEL_STAGE:
-        return f"models:/{MODEL_NAME}@{MODEL_STAGE}"
-
-    # Không có cả hai -> lấy version mới nhất đang có
-    vers = client.search_model_versions(f"name='{MODEL_NAME}'")
-    if not vers:
-        raise RuntimeError(f"Model '{MODEL_NAME}' chưa được đăng ký trong registry tại {TRACKING_URI}")
-    # sort theo version số
-    latest = max(vers, key=lambda v: int(v.version))
-    return f"models:/{latest.name}/{latest.version}"
-
-def load_model():
-    uri = resolve_model_uri()
-    print(f"[MLflow] tracking_uri = {mlflow.get_tracking_uri()}")
-    print(f"[MLflow] loading model: {uri}")
-    # Có thể bỏ filterwarnings nếu bạn muốn thấy cảnh báo mismatch để xử lý sau
-    warnings.filterwarnings("ignore")
-    return mlflow.pyfunc.load_model(uri)
-
-try:
-    MODEL = load_model()
-except Exception as e:
-    MODEL = None
-    # Gợi ý debug nhanh
-    print("[MLflow] Registered models:", [m.name for m in mlflow.search_registered_models()])
-    raise RuntimeError(f"Failed to load model: {e}") from e
-
-try:
-  warnings.filterwarnings("ignore")
-  MODEL = load_model()
-except Exception as e:
-  MODEL = None
-  raise RuntimeError(f"Failed to load model from : {e}")
+MODEL_POLL_SECONDS = float(os.getenv("MODEL_POLL_SECONDS", "0"))
+# RandomForest được trải phẳng thành mảng numpy lúc load (xem app/ml/forest.py); "0" để dùng pyfunc
+MODEL_COMPILED = os.getenv("MODEL_COMPILED", "1") not in ("0", "false", "False")
+# batch lớn hơn số dòng này predict bằng sklearn (xem BatchSizedForest); "0" = luôn compiled
+MODEL_COMPILED_MAX_ROWS = int(os.getenv("MODEL_COMPILED_MAX_ROWS", "256"))
+
+# model chỉ được load ở lần predict đầu tiên (hoặc warm-up lúc startup), không phải lúc import
+model_holder = ModelHolder(MODEL_NAME, version=MODEL_VER, stage=MODEL_STAGE, poll_interval=MODEL_POLL_SECONDS, compiled=MODEL_COMPILED,
+                           compiled_max_rows=MODEL_COMPILED_MAX_ROWS)
+
+
+def latest_lag_inputs(db_connection: Session, sources: list[str]) -> pd.DataFrame:
+  # lag vector mới nhất của từng source, đọc từ warehouse.feature_lags (build_features cập nhật)
+  rows = [{name: getattr(r, name) for name in ["source", *feature_names()]} for r in get_latest_lags(db_connection, sources)]
+  lags = pd.DataFrame(rows, columns=["source", *feature_names()]).set_index("source")
+
+  # source chưa có trong bảng lag (chưa rebuild lần nào) -> tính tạm từ features
+  missing = [s for s in sources if s not in lags.index]
+  if missing:
+    raw = get_features_by_sources(db_connection, missing)
+    if raw:
+      frame = build_lag_frame(pd.DataFrame(raw))
+      latest = frame.groupby("source").tail(1).set_index("source")[feature_names()]
+      lags = pd.concat([lags, latest]) if len(lags) else latest
+  return lags
 
 
 def prepare_input_features(city: str, db_connection: Session) -> pd.DataFrame:
-  # try:
-  #    df = get_all_features_by_city(db_connection, city=city)
-  #   #  df = pd.DataFrame([r.__dict__ for r in records])
-  #   #  df = df.drop(columns=["_sa_instance_state"], errors="ignore")
-  # except Exception as e:
-  #     raise RuntimeError(f"Error fetching features for city {city}: {e}")
-  raw = get_all_features_by_city(db_connection, city=city)
-  # ensure we have a pandas DataFrame (handles list of dicts, ORM objects, or already a DataFrame)
-  df: pd.DataFrame = pd.DataFrame(raw)
-  # drop SQLAlchemy instance-state if present
-  df = df.drop(columns=["_sa_instance_state"], errors="ignore")
-  
-  df["period_month"] = pd.to_datetime(df["period_month"], errors="coerce")
-  df = df.sort_values(["period_month"])
-
-  recent_data = df.tail(len(LAG_STEPS))
-    
-  if len(recent_data) < len(LAG_STEPS):
+  # chỉ dùng lịch sử của source khớp nhất, không trộn nhiều thành phố
+  sources = city_resolver.resolve(db_connection, city)
+  if not sources:
+      raise ValueError(f"Không tìm thấy dữ liệu cho '{city}'.")
+  lags = latest_lag_inputs(db_connection, sources[:1])
+  if len(lags) == 0:
       raise ValueError(f"Không đủ dữ liệu lịch sử cho '{city}'. Cần {len(LAG_STEPS)} tháng.")
+  return lags.reset_index(drop=True)
+
+
+def _predict(model, X: pd.DataFrame, kind: str = "single"):
+  start = time.perf_counter()
+  y = np.asarray(model.predict(X)).reshape(-1).astype(float)
+  observe_inference(kind, time.perf_counter() - start)
+  proba = None
+  try:
+     impl = getattr(model, "_model_impl", None)
+     if hasattr(impl, "predict_proba"):
+        p = np.asarray(impl.predict_proba(X))
+        proba = p[:, -1] if p.ndim == 2 and p.shape[1] > 1 else p.reshape(-1)
+  except Exception as e:
+     # proba chỉ là thông tin thêm: lỗi thì vẫn trả y, nhưng ghi lại để không bị nuốt mất
+     print(f"[MLflow] predict_proba lỗi, bỏ qua proba: {type(e).__name__}: {e}")
+  return y, proba
 
-  input_data = {}
-  features_list_ordered = [] 
-
-  t_minus_1_data = recent_data.iloc[-1]
-  t_minus_2_data = recent_data.iloc[-2]
-  t_minus_3_data = recent_data.iloc[-3]
-
-  for col in FEATURE_COLUMNS:
-      for lag in LAG_STEPS:
-          feature_name = f"{col}_lag{lag}"
-          features_list_ordered.append(feature_name)
-            
-          if lag == 1:
-              input_data[feature_name] = t_minus_1_data[col]
-          elif lag == 2:
-              input_data[feature_name] = t_minus_2_data[col]
-          elif lag == 3:
-              input_data[feature_name] = t_minus_3_data[col]
-                
-  input_df = pd.DataFrame([input_data], columns=features_list_ordered)
-    
-  return input_df
 
 def make_prediction(city: str, db_connection: Session):
-  model = MODEL
+  model, model_uri = model_holder.get()
   X = prepare_input_features(city, db_connection)
 
-  Y_pred = None
-  Y_proba = None
-
   try:
-    y = model.predict(X)
-
-    y = np.asarray(y).reshape(-1)
-    y_pred = float(y[0])
+    y, proba = _predict(model, X)
   except Exception as e:
     raise RuntimeError(f"Error during prediction for city {city}: {e}")
-  
-  try:
-     if hasattr(model._model_impl, "predict_proba"):
-        proba = model._model_impl.predict_proba(X)
-        proba = np.asarray(proba)
-        Y_proba = float(proba[0, -1]) if proba.ndim == 2 and proba.shape[1] > 1 else float(proba[0])
-  except Exception as e:
-     pass
-    
+
   return {
      "city": city,
-     "y_pred": y_pred,
-     "y_proba": Y_proba,
-     "model_uri": MODEL_URI,
+     "y_pred": float(y[0]),
+     "y_proba": float(proba[0]) if proba is not None else None,
+     "model_uri": model_uri,
      "model_name": MODEL_NAME
-  }
\ No newline at end of file
+  }
+
+
+def make_batch_prediction(cities: list[str], db_connection: Session) -> list[dict]:
+  model, model_uri = model_holder.get()
+  # 1 truy vấn resolve tất cả thành phố + 1 truy vấn lấy lag vector của các source khớp nhất
+  resolved = city_resolver.resolve_many(db_connection, cities)
+  best = {city: sources[0] for city, sources in resolved.items() if sources}
+  wanted = sorted(set(best.values()))
+  lags = latest_lag_inputs(db_connection, wanted) if wanted else pd.DataFrame(columns=feature_names())
+
+  # 1 lần model.predict cho toàn bộ các source đủ lịch sử
+  y, proba = _predict(model, lags.reset_index(drop=True), kind="batch") if len(lags) else ([], None)
+  row = {source: i for i, source in enumerate(lags.index)}
+
+  results = []
+  for city in cities:
+    source = best.get(city)
+    if source is None:
+      results.append({"city": city, "error": f"Không tìm thấy dữ liệu cho '{city}'."})
+    elif source not in row:
+      results.append({"city": city, "source": source, "error": f"Không đủ dữ liệu lịch sử cho '{city}'. Cần {len(LAG_STEPS)} tháng."})
+    else:
+      i = row[source]
+      results.append({
+        "city": city,
+        "source": source,
+        "y_pred": float(y[i]),
+        "y_proba": float(proba[i]) if proba is not None else None,
+        "model_uri": model_uri,
+        "model_name": MODEL_NAME,
+      })
+  return results
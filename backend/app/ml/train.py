@@ -1,89 +1,138 @@
+# python -m app.ml.train --splits 5 --workers 4
+import argparse, itertools, os, time, warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import TimeSeriesSplit, train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import r2_score, mean_absolute_error
 import mlflow
 from mlflow import sklearn as mlflow_sklearn
-import warnings
-from app.db.session import SessionLocal
-from app.services.features_service import get_all_features
-from mlflow.tracking import MlflowClient
 from mlflow.models.signature import infer_signature
-
-warnings.filterwarnings("ignore")
-
-target_column = "certified_facility_rate"
-
-feature_columns = [
-  'attp_cert_issued_count',
-  'attp_valid_count',
-  'processing_time_p50',
-  'processing_time_p90',
-  'facility_count',
-  'certified_facility_rate'
-]
-
-
-db = SessionLocal()
-try:
-  records = get_all_features(db)
-  df = pd.DataFrame([r.__dict__ for r in records])
-  df = df.drop(columns=["_sa_instance_state"], errors="ignore")
-except Exception as e:
-  raise RuntimeError(f"Error fetching features from database: {e}")
-finally:
-  db.close()
-
-
-
-df['period_month'] = pd.to_datetime(df['period_month'], errors='coerce')
-
-df[feature_columns] = df[feature_columns].fillna(0)
-
-df = df.sort_values(['source', 'period_month'])
-
-# Ví dụ tạo đặc trưng lùi thời gian
-features = []
-lag_steps = [1, 2, 3]
-for col in feature_columns:
-  for lag in lag_steps:
-    feature_name = f"{col}_lag{lag}"
-    features.append(feature_name)
-    df[feature_name] = df.groupby('source')[col].shift(lag)
-
-
-target = target_column
-
-df = df.dropna(subset=features + [target])
-
-X = df[features]
-Y = df[target]
-X = X.astype("float64")
-Y = Y.astype("float64")
-
-X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, shuffle=False)
-
-mlflow.set_experiment("attp_facility_rate_prediction")
-with mlflow.start_run():
-  model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
-  model.fit(X_train, Y_train)
-
-  pred = model.predict(X_test)
-
-  r2 = r2_score(Y_test, pred)
-  mae = mean_absolute_error(Y_test, pred)
-
-  mlflow.log_params({"model_type": "RandomForestRegressor", "n_estimators": 100, "lags": str(lag_steps)})
-  mlflow.log_metric("r2", r2)
-  mlflow.log_metric("mae", mae)
-
-  input_example = X_train.iloc[:5]
-  signature = infer_signature(X_train, model.predict(X_train))
-
-  mlflow_sklearn.log_model(
-    sk_model=model,
-    artifact_path="model",
-    signature=signature,
-    input_example=input_example,
-    registered_model_name="attp_facility_rate_prediction",
-  )
\ No newline at end of file
+from app.db.session import SessionLocal
+from app.models.models import FeatureLags
+from app.services.bulk_loader import copy_frame
+from app.ml.lags import LAG_STEPS, TARGET_COLUMN, feature_names, training_frame
+
+EXPERIMENT = "attp_facility_rate_prediction"
+REGISTERED_MODEL = "attp_facility_rate_prediction"
+
+PARAM_GRID = {
+    "n_estimators": [100, 300],
+    "max_depth": [None, 8, 16],
+    "min_samples_leaf": [1, 3, 5],
+    "max_features": [1.0, 0.5, "sqrt"],
+}
+
+
+def load_training_data() -> tuple[pd.DataFrame, pd.Series]:
+    # lag đã được build_features tính sẵn trong warehouse.feature_lags (cùng dữ liệu /ml/predict dùng);
+    # đọc bằng COPY -> pyarrow, không qua object ORM
+    db = SessionLocal()
+    try:
+        lags = copy_frame(db, FeatureLags, columns=["source", "period_month", *feature_names()], order_by=["source", "period_month"])
+    except Exception as e:
+        raise RuntimeError(f"Error fetching feature lags from database: {e}")
+    finally:
+        db.close()
+
+    df = training_frame(lags).dropna(subset=feature_names() + [TARGET_COLUMN])
+    # sắp theo thời gian để TimeSeriesSplit / tập test luôn là các tháng sau tập train
+    df = df.assign(_month=pd.to_datetime(df["period_month"], errors="coerce"))
+    df = df.sort_values(["_month", "source"], kind="stable").reset_index(drop=True)
+    return df[feature_names()].astype("float64"), df[TARGET_COLUMN].astype("float64")
+
+
+def candidates(grid: dict) -> list[dict]:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+# dữ liệu train gửi một lần cho mỗi process (initializer), không pickle lại theo từng ứng viên
+_X: np.ndarray | None = None
+_Y: np.ndarray | None = None
+_SPLITS: int = 5
+
+
+def _init_worker(X: np.ndarray, Y: np.ndarray, splits: int):
+    global _X, _Y, _SPLITS
+    warnings.filterwarnings("ignore")
+    _X, _Y, _SPLITS = X, Y, splits
+
+
+def evaluate(params: dict) -> dict:
+    # cross-validation theo thời gian cho một bộ tham số; mỗi process chỉ dùng 1 core (n_jobs=1)
+    start = time.perf_counter()
+    maes, r2s = [], []
+    for train_idx, valid_idx in TimeSeriesSplit(n_splits=_SPLITS).split(_X):
+        model = RandomForestRegressor(random_state=42, n_jobs=1, **params)
+        model.fit(_X[train_idx], _Y[train_idx])
+        pred = model.predict(_X[valid_idx])
+        maes.append(mean_absolute_error(_Y[valid_idx], pred))
+        r2s.append(r2_score(_Y[valid_idx], pred))
+    return {
+        "params": params,
+        "cv_mae": float(np.mean(maes)),
+        "cv_mae_std": float(np.std(maes)),
+        "cv_r2": float(np.mean(r2s)),
+        "fit_seconds": time.perf_counter() - start,
+    }
+
+
+def search(X: pd.DataFrame, Y: pd.Series, grid: dict, splits: int, workers: int) -> list[dict]:
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X.to_numpy(), Y.to_numpy(), splits)) as pool:
+        futures = [pool.submit(evaluate, params) for params in candidates(grid)]
+        for fut in as_completed(futures):
+            result = fut.result()
+            results.append(result)
+            # mỗi ứng viên một nested run (log từ process chính)
+            with mlflow.start_run(run_name="candidate", nested=True):
+                mlflow.log_params({k: str(v) for k, v in result["params"].items()})
+                mlflow.log_metrics({k: result[k] for k in ("cv_mae", "cv_mae_std", "cv_r2", "fit_seconds")})
+            print(f"[train] {result['params']} cv_mae={result['cv_mae']:.4f} cv_r2={result['cv_r2']:.4f} ({result['fit_seconds']:.1f}s)")
+    return sorted(results, key=lambda r: r["cv_mae"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train RandomForest dự đoán certified_facility_rate tháng kế tiếp")
+    parser.add_argument("--splits", type=int, default=5, help="số fold TimeSeriesSplit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="số process cho tìm tham số")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--no-register", action="store_true", help="không đăng ký model vào registry")
+    args = parser.parse_args(argv)
+    warnings.filterwarnings("ignore")
+
+    X, Y = load_training_data()
+    if len(X) <= args.splits + 1:
+        raise RuntimeError(f"Không đủ dữ liệu để train: {len(X)} dòng")
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=args.test_size, shuffle=False)
+
+    mlflow.set_experiment(EXPERIMENT)
+    with mlflow.start_run():
+        results = search(X_train, Y_train, PARAM_GRID, args.splits, args.workers)
+        best = results[0]
+        print(f"[train] best {best['params']} cv_mae={best['cv_mae']:.4f}")
+
+        # fit lại bộ tham số tốt nhất trên toàn bộ tập train, đánh giá trên các tháng sau cùng
+        model = RandomForestRegressor(random_state=42, n_jobs=-1, **best["params"])
+        model.fit(X_train, Y_train)
+        pred = model.predict(X_test)
+
+        mlflow.log_params({"model_type": "RandomForestRegressor", "lags": str(LAG_STEPS), "cv_splits": args.splits,
+                           "candidates": len(results), **{k: str(v) for k, v in best["params"].items()}})
+        mlflow.log_metric("cv_mae", best["cv_mae"])
+        mlflow.log_metric("r2", r2_score(Y_test, pred))
+        mlflow.log_metric("mae", mean_absolute_error(Y_test, pred))
+
+        mlflow_sklearn.log_model(
+            sk_model=model,
+            artifact_path="model",
+            signature=infer_signature(X_train, model.predict(X_train)),
+            input_example=X_train.iloc[:5],
+            registered_model_name=None if args.no_register else REGISTERED_MODEL,
+        )
+
+
+if __name__ == "__main__":
+    main()
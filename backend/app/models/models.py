@@ -3,7 +3,7 @@ import datetime
 import decimal
 
 from sqlalchemy import BigInteger, Boolean, CheckConstraint, Column, Date, DateTime, Double, ForeignKeyConstraint, Index, Integer, Numeric, PrimaryKeyConstraint, Table, Text, UniqueConstraint, text
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 class Base(DeclarativeBase):
@@ -118,6 +118,36 @@ class Features(Base):
     source: Mapped[Optional[str]] = mapped_column(Text)
 
 
+class FeatureLags(Base):
+    __tablename__ = 'feature_lags'
+    __table_args__ = (
+        PrimaryKeyConstraint('source', 'period_month', name='feature_lags_pkey'),
+        {'schema': 'warehouse'}
+    )
+
+    source: Mapped[str] = mapped_column(Text, primary_key=True)
+    period_month: Mapped[str] = mapped_column(Text, primary_key=True)
+    attp_cert_issued_count_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    attp_cert_issued_count_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    attp_cert_issued_count_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    attp_valid_count_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    attp_valid_count_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    attp_valid_count_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p50_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p50_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p50_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p90_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p90_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    processing_time_p90_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    facility_count_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    facility_count_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    facility_count_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    certified_facility_rate_lag1: Mapped[Optional[float]] = mapped_column(Double(53))
+    certified_facility_rate_lag2: Mapped[Optional[float]] = mapped_column(Double(53))
+    certified_facility_rate_lag3: Mapped[Optional[float]] = mapped_column(Double(53))
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
+
+
 class Datasets(Base):
     __tablename__ = 'datasets'
     __table_args__ = (
@@ -158,6 +188,26 @@ class IndicatorValues(Base):
     indicator: Mapped[Optional['Indicators']] = relationship('Indicators', back_populates='indicator_values')
 
 
+class FeatureBuilds(Base):
+    __tablename__ = 'feature_builds'
+    __table_args__ = (
+        PrimaryKeyConstraint('source', name='feature_builds_pkey'),
+        {'schema': 'core'}
+    )
+
+    source: Mapped[str] = mapped_column(Text, primary_key=True)
+    pending_task_id: Mapped[Optional[str]] = mapped_column(Text)
+    pending_uris: Mapped[list[str]] = mapped_column(ARRAY(Text), nullable=False, server_default=text("'{}'::text[]"))
+    running_task_id: Mapped[Optional[str]] = mapped_column(Text)
+    running_uris: Mapped[list[str]] = mapped_column(ARRAY(Text), nullable=False, server_default=text("'{}'::text[]"))
+    requested_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
+    dirty_since: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True))
+    failed_task_id: Mapped[Optional[str]] = mapped_column(Text)
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text('0'))
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    state_version: Mapped[Optional[str]] = mapped_column(Text)
+
+
 class RawFiles(Base):
     __tablename__ = 'raw_files'
     __table_args__ = (
@@ -174,6 +224,8 @@ class RawFiles(Base):
     checksum: Mapped[Optional[str]] = mapped_column(Text)
     ingested_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
     status: Mapped[Optional[str]] = mapped_column(Text)
+    task_id: Mapped[Optional[str]] = mapped_column(Text)
+    build_task_id: Mapped[Optional[str]] = mapped_column(Text)
 
     source: Mapped[Optional['Sources']] = relationship('Sources', back_populates='raw_files')
 
@@ -0,0 +1,144 @@
+import io
+import pandas as pd
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+COPY_CHUNK_ROWS = 50_000
+
+
+def _psycopg_connection(db: Session):
+  # connection psycopg 3 bên dưới session (cùng transaction); driver khác -> None, dùng đường ORM
+  conn = db.connection().connection.driver_connection
+  try:
+    import psycopg
+  except ImportError:
+    return None
+  return conn if isinstance(conn, psycopg.Connection) else None
+
+
+def _coerce(table, df: pd.DataFrame) -> pd.DataFrame:
+  # chỉ giữ các cột có trong bảng; giá trị không ép kiểu được thành NULL thay vì làm hỏng cả lệnh COPY
+  frame = df[[c.name for c in table.columns if c.name in df.columns]].copy()
+  for c in table.columns:
+    if c.name not in frame.columns:
+      continue
+    if isinstance(c.type, Date):
+      frame[c.name] = pd.to_datetime(frame[c.name], errors="coerce").dt.strftime("%Y-%m-%d")
+    elif isinstance(c.type, (Float, Integer)):
+      frame[c.name] = pd.to_numeric(frame[c.name], errors="coerce")
+  return frame
+
+
+def _records(frame: pd.DataFrame) -> list[dict]:
+  return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def _copy(conn, target, frame: pd.DataFrame):
+  from psycopg import sql
+  stmt = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+    target, sql.SQL(", ").join(map(sql.Identifier, frame.columns)),
+  )
+  with conn.cursor() as cur, cur.copy(stmt) as copy:
+    # ghi CSV theo từng chunk: ô rỗng không có dấu nháy = NULL
+    for start in range(0, len(frame), COPY_CHUNK_ROWS):
+      copy.write(frame.iloc[start:start + COPY_CHUNK_ROWS].to_csv(index=False, header=False, na_rep=""))
+
+
+def copy_insert(db: Session, model, df: pd.DataFrame) -> int:
+  # INSERT hàng loạt bằng COPY ... FROM STDIN; không commit (caller quyết định transaction)
+  table = model.__table__
+  frame = _coerce(table, df)
+  if frame.empty:
+    return 0
+  conn = _psycopg_connection(db)
+  if conn is None:
+    db.bulk_insert_mappings(model, _records(frame))
+    return len(frame)
+  from psycopg import sql
+  _copy(conn, sql.Identifier(table.schema, table.name), frame)
+  return len(frame)
+
+
+def copy_upsert(db: Session, model, df: pd.DataFrame, keys: list[str]) -> int:
+  # COPY vào bảng tạm rồi INSERT ... ON CONFLICT (keys) DO UPDATE vào bảng chính
+  table = model.__table__
+  frame = _coerce(table, df)
+  if frame.empty or not set(keys) <= set(frame.columns):
+    return 0
+  # ON CONFLICT không cho cập nhật cùng một dòng hai lần trong một lệnh
+  frame = frame.dropna(subset=keys).drop_duplicates(subset=keys, keep="first")
+  cols = list(frame.columns)
+  updates = [c for c in cols if c not in keys]
+
+  conn = _psycopg_connection(db)
+  if conn is None:
+    stmt = pg_insert(table)
+    if updates:
+      stmt = stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in updates})
+    else:
+      stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    db.execute(stmt, _records(frame))
+    return len(frame)
+
+  from psycopg import sql
+  target = sql.Identifier(table.schema, table.name)
+  tmp = sql.Identifier(f"_copy_{table.name}")
+  col_list = sql.SQL(", ").join(map(sql.Identifier, cols))
+  if updates:
+    on_conflict = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+      sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in updates
+    ))
+  else:
+    on_conflict = sql.SQL("DO NOTHING")
+
+  with conn.cursor() as cur:
+    cur.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(tmp, col_list, target))
+  _copy(conn, tmp, frame)
+  with conn.cursor() as cur:
+    cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) {}").format(
+      target, col_list, col_list, tmp, sql.SQL(", ").join(map(sql.Identifier, keys)), on_conflict,
+    ))
+    # bảng tạm xoá ngay để gọi lại được trong cùng transaction
+    cur.execute(sql.SQL("DROP TABLE {}").format(tmp))
+  return len(frame)
+
+
+def _arrow_type(col):
+  import pyarrow as pa
+  if isinstance(col.type, Float):
+    return pa.float64()
+  if isinstance(col.type, Integer):
+    return pa.int64()
+  if isinstance(col.type, Boolean):
+    return pa.bool_()
+  if isinstance(col.type, Date):
+    return pa.date32()
+  if isinstance(col.type, DateTime):
+    return pa.timestamp("us", tz="UTC")
+  return pa.string()
+
+
+def copy_frame(db: Session, model, columns: list[str] | None = None, order_by: list[str] | None = None) -> pd.DataFrame:
+  # SELECT -> COPY TO STDOUT (CSV) -> pyarrow: đọc theo cột, không tạo object ORM / dict cho từng dòng
+  table = model.__table__
+  cols = [table.c[name] for name in (columns or [c.name for c in table.columns])]
+  order = [table.c[name] for name in (order_by or [])]
+  conn = _psycopg_connection(db)
+  if conn is None:
+    return pd.read_sql(select(*cols).order_by(*order), db.connection())
+
+  import pyarrow.csv as pacsv
+  from psycopg import sql
+  query = sql.SQL("COPY (SELECT {} FROM {}{}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+    sql.SQL(", ").join(sql.Identifier(c.name) for c in cols),
+    sql.Identifier(table.schema, table.name),
+    sql.SQL(" ORDER BY {}").format(sql.SQL(", ").join(sql.Identifier(c.name) for c in order)) if order else sql.SQL(""),
+  )
+  buf = io.BytesIO()
+  with conn.cursor() as cur, cur.copy(query) as copy:
+    for block in copy:
+      buf.write(block)
+  buf.seek(0)
+  convert = pacsv.ConvertOptions(column_types={c.name: _arrow_type(c) for c in cols}, strings_can_be_null=True)
+  return pacsv.read_csv(buf, convert_options=convert).to_pandas()
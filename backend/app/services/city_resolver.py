@@ -0,0 +1,115 @@
+import asyncio, orjson
+from sqlalchemy import Text, column, func, desc, select, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.cache import make_cache_backend
+from app.core.config import settings
+from app.models.models import Features
+
+
+def normalize_city(city: str) -> str:
+  # pg_trgm không phân biệt hoa thường, gộp khoảng trắng để tăng tỉ lệ cache hit
+  return " ".join(city.split()).lower()
+
+
+class CityResolver:
+  # Cache chuỗi tìm kiếm -> danh sách source (đã sắp theo độ tương đồng) qua backend của app.core.cache:
+  # Redis khi có CACHE_URL (worker rebuild features xoá được cache của API), không thì LRU + TTL trong process
+  def __init__(self, backend):
+    self.backend = backend
+
+  def _lookup_stmts(self, cities: list[str], threshold: float):
+    # một truy vấn cho nhiều chuỗi: join danh sách chuỗi với features qua `%` (dùng được GIN trigram index)
+    q = values(column("city", Text), name="q").data([(city,) for city in cities])
+    sim = func.similarity(Features.source, q.c.city)
+    # ngưỡng của `%` lấy từ pg_trgm.similarity_threshold
+    set_threshold = select(func.set_config("pg_trgm.similarity_threshold", str(threshold), True))
+    stmt = (
+      select(q.c.city, Features.source, func.max(sim).label("score"))
+      .select_from(q)
+      .join(Features, Features.source.op("%")(q.c.city))
+      .group_by(q.c.city, Features.source)
+      .order_by(q.c.city, desc("score"), Features.source)
+    )
+    return set_threshold, stmt
+
+  @staticmethod
+  def _group(cities: list[str], rows) -> dict[str, list[str]]:
+    found: dict[str, list[str]] = {city: [] for city in cities}
+    for city, source, score in rows:
+      found[city].append(source)
+    return found
+
+  def lookup(self, db: Session, cities: list[str], threshold: float) -> dict[str, list[str]]:
+    set_threshold, stmt = self._lookup_stmts(cities, threshold)
+    db.execute(set_threshold)
+    return self._group(cities, db.execute(stmt).all())
+
+  async def lookup_async(self, db: AsyncSession, cities: list[str], threshold: float) -> dict[str, list[str]]:
+    set_threshold, stmt = self._lookup_stmts(cities, threshold)
+    await db.execute(set_threshold)
+    return self._group(cities, (await db.execute(stmt)).all())
+
+  @staticmethod
+  def _key(city: str, threshold: float) -> str:
+    return f"{threshold}:{city}"
+
+  def _cached(self, keys: set[str], threshold: float) -> dict[str, list[str]]:
+    keys = sorted(keys)
+    try:
+      hits = self.backend.get_many([self._key(key, threshold) for key in keys])
+    except Exception as e:
+      # cache lỗi thì truy vấn thẳng DB
+      print(f"Error reading city cache: {e}")
+      return {}
+    return {key: orjson.loads(hit) for key, hit in zip(keys, hits) if hit is not None}
+
+  def _store(self, found: dict[str, list[str]], threshold: float):
+    # tag theo source: rebuild một source chỉ xoá các chuỗi đã khớp source đó
+    try:
+      for key, sources in found.items():
+        self.backend.set(self._key(key, threshold), orjson.dumps(sources), sources)
+    except Exception as e:
+      print(f"Error writing city cache: {e}")
+
+  def resolve_many(self, db: Session, cities: list[str], threshold: float = 0.3) -> dict[str, list[str]]:
+    threshold = float(threshold)
+    keys = {city: normalize_city(city) for city in cities}
+    resolved = self._cached(set(keys.values()), threshold)
+    missing = sorted(set(keys.values()) - resolved.keys())
+    if missing:
+      found = self.lookup(db, missing, threshold)
+      self._store(found, threshold)
+      resolved.update(found)
+    return {city: list(resolved[key]) for city, key in keys.items()}
+
+  async def resolve_many_async(self, db: AsyncSession, cities: list[str], threshold: float = 0.3) -> dict[str, list[str]]:
+    threshold = float(threshold)
+    keys = {city: normalize_city(city) for city in cities}
+    # backend Redis là client sync -> đọc / ghi cache trong thread, không chặn event loop (lỗi đã bị nuốt trong _cached/_store)
+    resolved = await asyncio.to_thread(self._cached, set(keys.values()), threshold)
+    missing = sorted(set(keys.values()) - resolved.keys())
+    if missing:
+      found = await self.lookup_async(db, missing, threshold)
+      await asyncio.to_thread(self._store, found, threshold)
+      resolved.update(found)
+    return {city: list(resolved[key]) for city, key in keys.items()}
+
+  def resolve(self, db: Session, city: str, threshold: float = 0.3) -> list[str]:
+    return self.resolve_many(db, [city], threshold)[city]
+
+  async def resolve_async(self, db: AsyncSession, city: str, threshold: float = 0.3) -> list[str]:
+    return (await self.resolve_many_async(db, [city], threshold))[city]
+
+  def invalidate(self, source: str | None = None, new: bool = False):
+    # source mới có thể khớp với các truy vấn cũ -> xoá toàn bộ
+    try:
+      if source is None or new:
+        self.backend.clear()
+      else:
+        self.backend.invalidate_tag(source)
+    except Exception as e:
+      print(f"Error invalidating city cache: {e}")
+
+
+city_resolver = CityResolver(make_cache_backend(prefix="city:", maxsize=settings.city_cache_size, ttl=settings.city_cache_ttl))
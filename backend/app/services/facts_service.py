@@ -0,0 +1,27 @@
+import pandas as pd
+from sqlalchemy.orm import Session
+from app.models.models import FactFacility, FactAttpCertificate, FactCaseProcessing
+from app.services.bulk_loader import copy_upsert
+
+
+def _present(df: pd.DataFrame, col: str) -> pd.Series:
+  if col not in df.columns:
+    return pd.Series(False, index=df.index)
+  return df[col].notna() & (df[col].astype(str).str.strip() != "")
+
+
+def upsert_facts(db: Session, facilities: pd.DataFrame, commit: bool = True) -> dict:
+  # facilities: mỗi cơ sở một dòng (đã dedup); fact_facility trước vì hai bảng còn lại có FK tới nó
+  try:
+    counts = {
+      "fact_facility": copy_upsert(db, FactFacility, facilities, ["facility_id"]),
+      "fact_attp_certificate": copy_upsert(db, FactAttpCertificate, facilities[_present(facilities, "so_gcn_attp")], ["facility_id", "so_gcn_attp"]),
+      "fact_case_processing": copy_upsert(db, FactCaseProcessing, facilities[_present(facilities, "ngay_tiep_nhan")], ["facility_id"]),
+    }
+    if commit:
+      db.commit()
+    return counts
+  except Exception as e:
+    print(f"Error upserting fact tables: {e}")
+    db.rollback()
+    raise e
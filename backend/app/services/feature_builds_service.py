@@ -0,0 +1,153 @@
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.models import FeatureBuilds
+
+
+def request_build(db: Session, source: str, staging_uri: str, task_id: str) -> tuple[str, bool]:
+  # thêm staging_uri vào danh sách chờ của source; chỉ tạo task mới khi source chưa có task đang chờ
+  # trả về (task id sẽ build file này, task_id có phải task mới cần enqueue không)
+  try:
+    stmt = pg_insert(FeatureBuilds).values(source=source, pending_task_id=task_id, pending_uris=[staging_uri], requested_at=func.now(), dirty_since=func.now())
+    stmt = stmt.on_conflict_do_update(
+      index_elements=[FeatureBuilds.source],
+      set_={
+        "pending_uris": FeatureBuilds.pending_uris.op("||")(stmt.excluded.pending_uris),
+        "pending_task_id": func.coalesce(FeatureBuilds.pending_task_id, stmt.excluded.pending_task_id),
+        "requested_at": func.now(),
+        "dirty_since": func.coalesce(FeatureBuilds.dirty_since, func.now()),
+      },
+    ).returning(FeatureBuilds.pending_task_id)
+    pending_task_id = db.execute(stmt).scalar_one()
+    db.commit()
+    return pending_task_id, pending_task_id == task_id
+  except Exception as e:
+    print(f"Error requesting feature build: {e}")
+    db.rollback()
+    raise e
+
+
+def build_state(db: Session, build_task_id: str) -> str:
+  # "pending": đang chờ quiet window / lượt build; "running": đang build;
+  # "failed": build lỗi và không còn tự build lại; "done": không còn trong hàng đợi
+  row = db.execute(
+    select(FeatureBuilds.pending_task_id, FeatureBuilds.running_task_id)
+    .where(or_(
+      FeatureBuilds.pending_task_id == build_task_id,
+      FeatureBuilds.running_task_id == build_task_id,
+      FeatureBuilds.failed_task_id == build_task_id,
+    ))
+  ).first()
+  if row is None:
+    return "done"
+  if row.running_task_id == build_task_id:
+    return "running"
+  return "pending" if row.pending_task_id == build_task_id else "failed"
+
+
+def request_retry(db: Session, source: str, task_id: str) -> tuple[str, bool]:
+  # sau build lỗi (uri đã về danh sách chờ): gắn task_id nếu source chưa có task đang chờ
+  # trả về (task id sẽ build lại, task_id có phải task mới cần enqueue không)
+  try:
+    pending_task_id = db.execute(
+      update(FeatureBuilds)
+      .where(FeatureBuilds.source == source)
+      .values(pending_task_id=func.coalesce(FeatureBuilds.pending_task_id, task_id))
+      .returning(FeatureBuilds.pending_task_id)
+    ).scalar_one()
+    db.commit()
+    return pending_task_id, pending_task_id == task_id
+  except Exception as e:
+    print(f"Error requesting feature build retry: {e}")
+    db.rollback()
+    raise e
+
+
+def cancel_request(db: Session, source: str, task_id: str):
+  # enqueue lỗi: bỏ task id, các uri vẫn chờ và sẽ đi cùng lần request sau
+  try:
+    db.execute(
+      update(FeatureBuilds)
+      .where(FeatureBuilds.source == source, FeatureBuilds.pending_task_id == task_id)
+      .values(pending_task_id=None)
+    )
+    db.commit()
+  except Exception as e:
+    print(f"Error cancelling feature build: {e}")
+    db.rollback()
+    raise e
+
+
+def build_delay(db: Session, source: str, quiet: float, max_delay: float) -> float:
+  # số giây còn phải chờ: tới khi hết quiet window kể từ upload gần nhất,
+  # nhưng không quá max_delay kể từ upload đầu tiên chưa build; 0 = build ngay
+  row = db.execute(
+    select(FeatureBuilds.requested_at, FeatureBuilds.dirty_since, func.now()).where(FeatureBuilds.source == source)
+  ).one_or_none()
+  if row is None or row.dirty_since is None:
+    return 0.0
+  requested_at, dirty_since, now = row
+  quiet_left = (requested_at - now).total_seconds() + quiet
+  max_left = (dirty_since - now).total_seconds() + max_delay
+  return max(0.0, min(quiet_left, max_left))
+
+
+def claim_build(db: Session, source: str, task_id: str) -> list[str]:
+  # gọi khi đang giữ lock build của source: chuyển các uri đang chờ sang "running" cho task này
+  try:
+    row = db.execute(select(FeatureBuilds).where(FeatureBuilds.source == source).with_for_update()).scalar_one_or_none()
+    if row is None:
+      return []
+    if row.running_task_id == task_id:
+      # task bị giao lại (acks_late, worker chết giữa chừng): build lại đúng các uri đã nhận
+      uris = list(row.running_uris)
+    else:
+      # running_uris còn lại của task trước (đã chết, lock đã nhả) được gộp vào lần này
+      uris = list(row.running_uris) + list(row.pending_uris)
+      row.running_uris = uris
+      row.running_task_id = task_id
+    row.pending_uris = []
+    row.pending_task_id = None
+    row.dirty_since = None
+    db.commit()
+    return uris
+  except Exception as e:
+    print(f"Error claiming feature build: {e}")
+    db.rollback()
+    raise e
+
+
+def finish_build(db: Session, source: str, task_id: str, failed: bool = False, error: str | None = None) -> int:
+  # lỗi: trả các uri về danh sách chờ (đứng trước các uri mới hơn) để lần build sau xử lý lại,
+  # ghi lại task lỗi; trả về số lần lỗi liên tiếp của source (0 nếu build thành công)
+  try:
+    values = {"running_task_id": None, "running_uris": []}
+    if failed:
+      values["pending_uris"] = FeatureBuilds.running_uris.op("||")(FeatureBuilds.pending_uris)
+      values["dirty_since"] = func.coalesce(FeatureBuilds.dirty_since, func.now())
+      values.update(failed_task_id=task_id, failures=FeatureBuilds.failures + 1, last_error=error)
+    else:
+      values.update(failed_task_id=None, failures=0, last_error=None)
+    failures = db.execute(
+      update(FeatureBuilds)
+      .where(FeatureBuilds.source == source, FeatureBuilds.running_task_id == task_id)
+      .values(**values)
+      .returning(FeatureBuilds.failures)
+    ).scalar_one_or_none()
+    db.commit()
+    return failures or 0
+  except Exception as e:
+    print(f"Error finishing feature build: {e}")
+    db.rollback()
+    raise e
+
+
+def get_state_version(db: Session, source: str) -> str | None:
+  return db.execute(select(FeatureBuilds.state_version).where(FeatureBuilds.source == source)).scalar_one_or_none()
+
+
+def set_state_version(db: Session, source: str, version: str):
+  # không commit: con trỏ state đổi trong cùng transaction ghi features của lần build
+  stmt = pg_insert(FeatureBuilds).values(source=source, state_version=version)
+  stmt = stmt.on_conflict_do_update(index_elements=[FeatureBuilds.source], set_={"state_version": stmt.excluded.state_version})
+  db.execute(stmt)
@@ -1,35 +1,119 @@
 from sqlalchemy.orm import Session
-from app.models.models import Features
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import Features, FeatureLags
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy import func, desc
+from contextlib import contextmanager
+from sqlalchemy import func, desc, select
+from app.db.session import engine
+from app.services.city_resolver import city_resolver
+from app.services.pagination import keyset_page, keyset_page_async, DEFAULT_LIMIT
+from app.services.bulk_loader import copy_insert
 
 
-def create_bulk_features(db: Session, features_data):
-  if not features_data:
+def create_bulk_features(db: Session, features, commit: bool = True):
+  # features: DataFrame, ghi bằng COPY
+  if features.empty:
       return
   try:
-     db.bulk_insert_mappings(Features, features_data)
-     db.commit()
+     copy_insert(db, Features, features)
+     if commit:
+        db.commit()
   except Exception as e:
       print(f"Error inserting features: {e}")
       db.rollback()
       raise e
   
+@contextmanager
+def source_build_lock(source: str):
+  # advisory lock theo source trên một connection riêng: các lần rebuild cùng source chạy tuần tự
+  # (cả đọc/ghi state lẫn ghi DB), khác source vẫn song song; connection chết thì Postgres tự nhả lock
+  key = (func.hashtext("features"), func.hashtext(source))
+  with engine.connect() as conn:
+     conn.execute(select(func.pg_advisory_lock(*key)))
+     conn.commit()
+     try:
+        yield
+     finally:
+        conn.execute(select(func.pg_advisory_unlock(*key)))
+        conn.commit()
+
 def get_all_features_by_city(db: Session, city: str, threshold = 0.3):
-    sim = func.similarity(Features.source, city)
     try:
-        results = (
-            db.query(Features, sim.label("score"))
-            .filter(sim >= threshold)
-            .order_by(desc("score"))
+        sources = city_resolver.resolve(db, city, threshold)
+        if not sources:
+            return []
+        # giữ thứ tự theo độ tương đồng của source như trước
+        rank = {source: i for i, source in enumerate(sources)}
+        results = db.query(Features).filter(Features.source.in_(sources)).all()
+        results.sort(key=lambda feature: rank[feature.source])
+        return [jsonable_encoder(feature) for feature in results]
+    except Exception as e:
+        print(f"Error fetching features for city {city}: {e}")
+        return []
+
+async def find_features_by_city_async(db: AsyncSession, city: str, threshold = 0.3):
+    # như get_all_features_by_city_async nhưng không nuốt lỗi (để không cache kết quả lỗi)
+    sources = await city_resolver.resolve_async(db, city, threshold)
+    if not sources:
+        return []
+    rank = {source: i for i, source in enumerate(sources)}
+    results = list((await db.scalars(select(Features).where(Features.source.in_(sources)))).all())
+    results.sort(key=lambda feature: rank[feature.source])
+    return [jsonable_encoder(feature) for feature in results]
+
+async def get_all_features_by_city_async(db: AsyncSession, city: str, threshold = 0.3):
+    try:
+        return await find_features_by_city_async(db, city, threshold)
+    except Exception as e:
+        print(f"Error fetching features for city {city}: {e}")
+        return []
+
+def get_features_by_sources(db: Session, sources: list[str]):
+    try:
+        results = db.query(Features).filter(Features.source.in_(sources)).all()
+        return [jsonable_encoder(feature) for feature in results]
+    except Exception as e:
+        print(f"Error fetching features for sources {sources}: {e}")
+        return []
+
+def replace_feature_lags(db: Session, source: str, lags, commit: bool = True):
+  try:
+     db.query(FeatureLags).filter(FeatureLags.source == source).delete(synchronize_session=False)
+     copy_insert(db, FeatureLags, lags)
+     if commit:
+        db.commit()
+  except Exception as e:
+      print(f"Error replacing feature lags: {e}")
+      db.rollback()
+      raise e
+
+def get_latest_lags(db: Session, sources: list[str]):
+    # DISTINCT ON (source) ... ORDER BY source, period_month DESC -> đi theo primary key
+    try:
+        return (
+            db.query(FeatureLags)
+            .filter(FeatureLags.source.in_(sources))
+            .distinct(FeatureLags.source)
+            .order_by(FeatureLags.source, desc(FeatureLags.period_month))
             .all()
         )
-        # results is a list of tuples (Features, score); return JSON-serializable dicts
-        return [jsonable_encoder(feature) for feature, score in results]
     except Exception as e:
-        print(f"Error fetching features for city {city}: {e}")
+        print(f"Error fetching feature lags for sources {sources}: {e}")
         return []
-    
+
+def get_all_feature_lags(db: Session):
+    try:
+        return db.query(FeatureLags).all()
+    except Exception as e:
+        print(f"Error fetching feature lags: {e}")
+        return []
+
+def get_features_page(db: Session, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
+    return keyset_page(db, Features, after_id=after_id, limit=limit)
+
+async def get_features_page_async(db: AsyncSession, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
+    return await keyset_page_async(db, Features, after_id=after_id, limit=limit)
+
 def get_all_features(db: Session):
     try:
         results = db.query(Features).all()
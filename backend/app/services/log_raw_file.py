@@ -3,11 +3,13 @@ from sqlalchemy.dialects.postgresql import insert
 from ..models.models import RawFiles
 from sqlalchemy.orm import Session
 
-def log_raw_file(db: Session, source_id: int, bucket: str, key: str, checksum: str, status: str = "new"):
+def log_raw_file(db: Session, source_id: int, bucket: str, key: str, checksum: str, status: str = "new", task_id: str | None = None):
   path = f"s3://{bucket}/{key}"
   try:
-    db.add(RawFiles(source_id=source_id, path=path, checksum=checksum, status=status))
+    raw_file = RawFiles(source_id=source_id, path=path, checksum=checksum, status=status, task_id=task_id)
+    db.add(raw_file)
     db.commit()
+    return raw_file
   except Exception as e:
     print(f"Error logging raw file: {e}")
     db.rollback()
@@ -18,4 +20,50 @@ def get_raw_file(db: Session):
     return db.query(RawFiles).all()
   except Exception as e:
     print(f"Error fetching raw files: {e}")
-    return []
\ No newline at end of file
+    return []
+
+def get_raw_file_by_checksum(db: Session, checksum: str):
+  # dùng unique index checksum_unique
+  return db.query(RawFiles).filter(RawFiles.checksum == checksum).one_or_none()
+
+def update_raw_file(db: Session, raw_file: RawFiles, **fields):
+  try:
+    for name, value in fields.items():
+      setattr(raw_file, name, value)
+    db.commit()
+    return raw_file
+  except Exception as e:
+    print(f"Error updating raw file: {e}")
+    db.rollback()
+    raise e
+
+def get_raw_file_by_task_id(db: Session, task_id: str):
+  return db.query(RawFiles).filter(RawFiles.task_id == task_id).one_or_none()
+
+def set_raw_file_build_task(db: Session, path: str, build_task_id: str):
+  try:
+    db.query(RawFiles).filter(RawFiles.path == path).update({RawFiles.build_task_id: build_task_id}, synchronize_session=False)
+    db.commit()
+  except Exception as e:
+    print(f"Error updating raw file build task: {e}")
+    db.rollback()
+    raise e
+
+def move_raw_files_build_task(db: Session, old_build_task_id: str, new_build_task_id: str):
+  # build lỗi được build lại bằng task khác -> /upload/task theo dõi task mới
+  try:
+    db.query(RawFiles).filter(RawFiles.build_task_id == old_build_task_id).update({RawFiles.build_task_id: new_build_task_id}, synchronize_session=False)
+    db.commit()
+  except Exception as e:
+    print(f"Error moving raw file build task: {e}")
+    db.rollback()
+    raise e
+
+def set_raw_file_status(db: Session, path: str, status: str):
+  try:
+    db.query(RawFiles).filter(RawFiles.path == path).update({RawFiles.status: status}, synchronize_session=False)
+    db.commit()
+  except Exception as e:
+    print(f"Error updating raw file status: {e}")
+    db.rollback()
+    raise e
@@ -1,5 +1,7 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.models import IngestLogs
+from app.services.pagination import keyset_page, keyset_page_async, DEFAULT_LIMIT
 
 def log_ingest(db: Session, source_key: str, log: str):
   try:
@@ -10,9 +12,16 @@ def log_ingest(db: Session, source_key: str, log: str):
     db.rollback()
     raise e
 
-def get_ingest_logs(db: Session):
+def get_ingest_logs(db: Session, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
   try:
-    return db.query(IngestLogs).all()
+    return keyset_page(db, IngestLogs, after_id=after_id, limit=limit)
   except Exception as e:
     print(f"Error fetching ingest logs: {e}")
-    return []
\ No newline at end of file
+    return [], None
+
+async def get_ingest_logs_async(db: AsyncSession, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
+  try:
+    return await keyset_page_async(db, IngestLogs, after_id=after_id, limit=limit)
+  except Exception as e:
+    print(f"Error fetching ingest logs: {e}")
+    return [], None
\ No newline at end of file
@@ -0,0 +1,55 @@
+import orjson
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.db.session import AsyncSessionLocal
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+STREAM_BATCH = 1000
+
+
+def row_to_dict(row) -> dict:
+  return {attr.key: getattr(row, attr.key) for attr in inspect(type(row)).column_attrs}
+
+
+def _keyset_stmt(model, after_id: int | None):
+  # phân trang theo id (WHERE id > cursor ORDER BY id LIMIT n): chi phí không tăng theo số trang
+  stmt = select(model)
+  if after_id is not None:
+    stmt = stmt.where(model.id > after_id)
+  return stmt.order_by(model.id)
+
+
+def _page(rows, limit: int) -> tuple[list[dict], int | None]:
+  next_cursor = rows[limit - 1].id if len(rows) > limit else None
+  return [row_to_dict(r) for r in rows[:limit]], next_cursor
+
+
+def keyset_page(db: Session, model, after_id: int | None = None, limit: int = DEFAULT_LIMIT) -> tuple[list[dict], int | None]:
+  rows = db.scalars(_keyset_stmt(model, after_id).limit(limit + 1)).all()
+  return _page(rows, limit)
+
+
+async def keyset_page_async(db: AsyncSession, model, after_id: int | None = None, limit: int = DEFAULT_LIMIT) -> tuple[list[dict], int | None]:
+  rows = (await db.scalars(_keyset_stmt(model, after_id).limit(limit + 1))).all()
+  return _page(rows, limit)
+
+
+async def stream_ndjson(model, after_id: int | None = None, batch_size: int = STREAM_BATCH):
+  # session riêng cho response: server-side cursor (yield_per) đọc từng batch, mỗi dòng một JSON
+  async with AsyncSessionLocal() as db:
+    rows = await db.stream_scalars(_keyset_stmt(model, after_id).execution_options(yield_per=batch_size))
+    async for row in rows:
+      yield orjson.dumps(row_to_dict(row)) + b"\n"
+
+
+def page_response(rows: list[dict], next_cursor: int | None) -> ORJSONResponse:
+  # body vẫn là list như trước; cursor trang sau nằm trong header (không có header = trang cuối)
+  headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+  return ORJSONResponse(rows, headers=headers)
+
+
+def ndjson_response(model, after_id: int | None = None) -> StreamingResponse:
+  return StreamingResponse(stream_ndjson(model, after_id=after_id), media_type="application/x-ndjson")
@@ -1,18 +1,28 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.models import Sources
+from app.services.pagination import keyset_page, keyset_page_async, DEFAULT_LIMIT
 
-def get_all_sources(db: Session):
+def get_all_sources(db: Session, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
   try:
-    results = db.query(Sources).all()
-    return results
+    return keyset_page(db, Sources, after_id=after_id, limit=limit)
   except Exception as e:
     print(f"Error fetching sources: {e}")
-    return []
+    return [], None
+
+async def get_all_sources_async(db: AsyncSession, after_id: int | None = None, limit: int = DEFAULT_LIMIT):
+  try:
+    return await keyset_page_async(db, Sources, after_id=after_id, limit=limit)
+  except Exception as e:
+    print(f"Error fetching sources: {e}")
+    return [], None
   
 def add_source(db: Session, name: str, url: str, kind: str, owner: str, license: str, update_frequency: str):
   try:
-    db.add(Sources(name=name, url=url, kind=kind, owner=owner, license=license, update_frequency=update_frequency))
+    src = Sources(name=name, url=url, kind=kind, owner=owner, license=license, update_frequency=update_frequency)
+    db.add(src)
     db.commit()
+    return src
   except Exception as e:
     print(f"Error adding source: {e}")
     db.rollback()
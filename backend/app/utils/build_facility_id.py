@@ -1,8 +1,43 @@
+import numpy as np
 import pandas as pd
 
+# thứ tự ưu tiên: số GCN ĐKKD -> số GCN ATTP -> id "soft" từ tên + địa chỉ
+ID_KEYS = ["so_gcn_dkkd", "so_gcn_attp"]
+SOFT_KEYS = ["ten_co_so", "dia_chi", "quan_huyen"]
+
+def stable_hash(values) -> np.ndarray:
+    # siphash với key cố định của pandas: giống nhau giữa các worker và các lần chạy (khác hash() của Python)
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+def _soft_part(v) -> str:
+    # NaN / None / pd.NA đều ghi là "nan" để csv và parquet cho cùng một id
+    return str(v) if pd.notna(v) else "nan"
+
 def build_facility_id(row: pd.Series) -> str:
-    for k in ["so_gcn_dkkd","so_gcn_attp"]:
+    for k in ID_KEYS:
         if k in row and pd.notna(row[k]) and str(row[k]).strip()!='':
             return f"fac::{str(row[k]).strip()}"
-    t = str(row.get("ten_co_so", "")) + "|" + str(row.get("dia_chi","")) + "|" + str(row.get("quan_huyen",""))
-    return f"fac::soft::{abs(hash(t))}"
\ No newline at end of file
+    t = _soft_part(row.get("ten_co_so", "")) + "|" + _soft_part(row.get("dia_chi","")) + "|" + _soft_part(row.get("quan_huyen",""))
+    return f"fac::soft::{stable_hash([t])[0]}"
+
+def build_facility_ids(df: pd.DataFrame) -> pd.Series:
+    # bản vector hoá của build_facility_id, cùng quy tắc ưu tiên
+    ids = pd.Series(None, index=df.index, dtype=object)
+    pending = pd.Series(True, index=df.index)
+    for k in ID_KEYS:
+        if k not in df.columns:
+            continue
+        s = df[k].astype(str).str.strip()
+        ok = pending & df[k].notna() & (s != '')
+        ids[ok] = "fac::" + s[ok]
+        pending &= ~ok
+
+    if pending.any():
+        rest = df.loc[pending]
+        parts = [
+            rest[c].astype(str).where(rest[c].notna(), "nan") if c in rest.columns else pd.Series("", index=rest.index)
+            for c in SOFT_KEYS
+        ]
+        t = parts[0] + "|" + parts[1] + "|" + parts[2]
+        ids[pending] = "fac::soft::" + pd.Series(stable_hash(t.to_numpy()), index=rest.index).astype(str)
+    return ids
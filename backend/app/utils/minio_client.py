@@ -1,5 +1,7 @@
 import hashlib, os, io, datetime as dt
 from minio import Minio
+from minio.commonconfig import CopySource
+from app.core.metrics import record_minio_read
 
 def make_minio():
     from os import getenv
@@ -18,11 +20,84 @@ def ensure_bucket(client, bucket: str) -> str:
 def md5_of_bytes(b: bytes) -> str:
     return hashlib.md5(b).hexdigest()
 
+class HashingReader:
+    # bọc file-like: tính md5 dần trong lúc MinIO đọc để upload
+    def __init__(self, fileobj):
+        self._f = fileobj
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._f.read(size)
+        self._md5.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
+
+class CountingReader:
+    # bọc response get_object khi đọc dần (pandas đọc theo chunk): đếm byte đã đọc từ MinIO
+    def __init__(self, obj, bucket: str):
+        self._obj = obj
+        self._bucket = bucket
+
+    def read(self, size=-1):
+        chunk = self._obj.read() if size is None or size < 0 else self._obj.read(size)
+        record_minio_read(self._bucket, len(chunk))
+        return chunk
+
+    def __iter__(self):
+        # pandas chỉ coi là file-like nếu có __iter__
+        return iter(lambda: self.read(64 * 1024), b"")
+
 def put_bytes(client, bucket: str, key: str, data: bytes, content_type="application/octet-stream") -> str:
     ensure_bucket(client, bucket)
     client.put_object(bucket, key, io.BytesIO(data), length=len(data), content_type=content_type)
     return f"s3://{bucket}/{key}"
 
+def put_stream(client, bucket: str, key: str, stream, content_type="application/octet-stream", part_size=10 * 1024 * 1024) -> str:
+    # length=-1 -> MinIO tự chia multipart, mỗi lần chỉ giữ một part trong bộ nhớ
+    ensure_bucket(client, bucket)
+    client.put_object(bucket, key, stream, length=-1, part_size=part_size, content_type=content_type)
+    return f"s3://{bucket}/{key}"
+
+def move_object(client, bucket: str, src_key: str, dst_key: str) -> str:
+    # copy phía server (tự dùng multipart copy nếu > 5GiB) rồi xoá object nguồn
+    client.copy_object(bucket, dst_key, CopySource(bucket, src_key))
+    client.remove_object(bucket, src_key)
+    return f"s3://{bucket}/{dst_key}"
+
+class IterStream(io.RawIOBase):
+    # file-like chỉ đọc, lấy dữ liệu dần từ một iterator bytes
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buf)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
 def today_path():
     d = dt.datetime.utcnow()
     return f"{d:%Y-%m-%d}"
+
+def get_bytes(client, bucket: str, key: str) -> bytes:
+    obj = client.get_object(bucket, key)
+    try:
+        data = obj.read()
+        record_minio_read(bucket, len(data))
+        return data
+    finally:
+        obj.close(); obj.release_conn()
@@ -1,7 +1,12 @@
-import io, json, pandas as pd, datetime as dt, re
+import io, os, json, time, pandas as pd, numpy as np, datetime as dt, re
+import pyarrow as pa, pyarrow.parquet as pq
 from urllib.parse import urlparse
-from app.utils.minio_client import make_minio, put_bytes, ensure_bucket
+from minio.error import S3Error
+from app.utils.minio_client import make_minio, put_bytes, put_stream, ensure_bucket, get_bytes, IterStream, CountingReader
+from app.core.config import settings
+from app.core.metrics import StageTimer, stage_timer
 from app.services.log_service import log_ingest
+from app.services.log_raw_file import set_raw_file_status
 from app.db.session import SessionLocal
 
 def normalize_columns(cols):
@@ -11,52 +16,37 @@ def normalize_columns(cols):
         return s
     return [norm(c) for c in cols]
 
-def clean_data_service(raw_uri: str, *, source: str, cfg: dict | None, cfg_uri: str | None) -> str:
-    client = make_minio()
-    p = urlparse(raw_uri)
-    obj = client.get_object(p.netloc, p.path.lstrip("/"))
-    raw = obj.read(); obj.close(); obj.release_conn()
-
-    # load config (ưu tiên cfg đã truyền)
-    if cfg is None and cfg_uri:
-        cp = urlparse(cfg_uri)
-        cobj = client.get_object(cp.netloc, cp.path.lstrip("/"))
-        cfg = json.loads(cobj.read().decode("utf-8"))
-        cobj.close(); cobj.release_conn()
-    cfg = cfg or {}
-
-    file_cfg = cfg.get("file", {})
-    fmt = (file_cfg.get("format") or "csv").lower()
-    if fmt == "csv":
-        df = pd.read_csv(io.BytesIO(raw))
-    elif fmt in ("xlsx","excel"): df = pd.read_excel(io.BytesIO(raw), header=file_cfg.get("header_row", 0))
-    else: df = pd.read_json(io.BytesIO(raw))
+def resolve_defaults(cfg: dict) -> dict:
+    # "@now:<fmt>" được tính một lần cho cả file, không phải cho từng chunk
+    defaults = {}
+    for col, val in (cfg.get("defaults") or {}).items():
+      if isinstance(val, str) and val.startswith("@now:"):
+        fmt = val.split(":", 1)[1]
+        defaults[col] = dt.datetime.now().strftime(fmt)
+      else:
+        defaults[col] = val
+    return defaults
 
+def apply_config(df: pd.DataFrame, cfg: dict, defaults: dict, keep_dates: bool = False) -> pd.DataFrame:
     # map + defaults + types + transforms (rút gọn)
     df.columns = normalize_columns(df.columns)
     mapping = {k: v for k, v in (cfg.get("column_map") or {}).items()}
     df = df.rename(columns=mapping)
 
     # defaults
-    defaults = cfg.get("defaults", {})
-    out = df.copy()
-    for col, val in defaults.items():
-      fill_value = None
-      if isinstance(val, str) and val.startswith("@now:"):
-        fmt = val.split(":", 1)[1]
-        fill_value = dt.datetime.now().strftime(fmt)
-      else:
-        fill_value = val
-      if col not in out.columns:
-        out[col] = fill_value
+    for col, fill_value in defaults.items():
+      if col not in df.columns:
+        df[col] = fill_value
       else:
-         out[col] = out[col].fillna(fill_value)
+         df[col] = df[col].fillna(fill_value)
     # types (ví dụ)
     for col, ts in (cfg.get("types") or {}).items():
         if col in df:
             if ts.startswith("date:"):
                 fmt = ts.split(":",1)[1]
-                df[col] = pd.to_datetime(df[col], format=fmt, errors="coerce").dt.date.astype("string")
+                d = pd.to_datetime(df[col], format=fmt, errors="coerce")
+                # parquet giữ được kiểu ngày, csv thì ghi dạng chuỗi như cũ
+                df[col] = d.dt.normalize() if keep_dates else d.dt.date.astype("string")
             elif ts == "bool": df[col] = df[col].astype(str).str.lower().isin(["1","true","yes","x","co","có"])
             elif ts == "int": df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
             elif ts == "str": df[col] = df[col].astype("string")
@@ -73,15 +63,278 @@ def clean_data_service(raw_uri: str, *, source: str, cfg: dict | None, cfg_uri:
                     else: df[c] = s.str.upper()
         elif op == "replace" and tr.get("col") in df:
             df[tr["col"]] = df[tr["col"]].replace(tr.get("map", {}))
-    # save staging
+    return df
+
+CHECKSUM_RE = re.compile(r"^([0-9a-f]{32})_")
+
+def excel_engine() -> str | None:
+    # calamine (Rust) nhanh hơn openpyxl nhiều lần, cho cùng kết quả; không cài thì để pandas chọn (openpyxl)
+    engine = settings.excel_engine.lower()
+    if engine != "auto":
+        return engine or None
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    return "calamine"
+
+def _is_date_cell(v) -> bool:
+    return isinstance(v, (dt.datetime, dt.date))
+
+def _excel_as_str(df: pd.DataFrame) -> pd.DataFrame:
+    # như dtype=str nhưng giữ ô kiểu ngày của Excel: dtype=str biến chúng thành "2021-03-05 00:00:00"
+    # và "date:%d/%m/%Y" trong config sẽ ra NaT. Cột toàn ngày -> datetime64, cột lẫn ngày/chuỗi giữ nguyên ô ngày
+    for col in df.columns:
+        s = df[col]
+        kind = pd.api.types.infer_dtype(s, skipna=True)
+        if kind in ("datetime", "datetime64", "date"):
+            df[col] = pd.to_datetime(s, errors="coerce")
+            continue
+        if kind in ("string", "empty"):
+            continue
+        cells = s.notna()
+        if kind.startswith("mixed"):
+            cells &= ~s.map(_is_date_cell)
+        if cells.any():
+            s = s.copy()
+            s[cells] = s[cells].astype(str)
+            df[col] = s
+    return df
+
+def _read_frame(raw, file_cfg: dict, fmt: str, dtype=None) -> pd.DataFrame:
+    if fmt == "csv":
+        return pd.read_csv(raw, dtype=dtype)
+    elif fmt in ("xlsx","excel"):
+        header, engine = file_cfg.get("header_row", 0), excel_engine()
+        if dtype is str:
+            return _excel_as_str(pd.read_excel(raw, header=header, dtype=object, engine=engine))
+        return pd.read_excel(raw, header=header, dtype=dtype, engine=engine)
+    else: return pd.read_json(raw)
+
+def _frame_chunks(df: pd.DataFrame, chunk_rows: int):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].copy()
+
+def parse_cache_key(raw_key: str, file_cfg: dict, fmt: str, dtype=None) -> str | None:
+    # upload lưu raw ở .../{md5}_{tên file}: cùng checksum = cùng nội dung -> cache không bao giờ cũ;
+    # key gồm các tuỳ chọn parse (định dạng, header_row, đọc thành chuỗi hay tự suy kiểu)
+    if not settings.parse_cache or fmt not in {f.strip() for f in settings.parse_cache_formats.split(",")}:
+        return None
+    m = CHECKSUM_RE.match(raw_key.rsplit("/", 1)[-1])
+    if m is None:
+        return None
+    kind = "str" if dtype is str else "auto"
+    # v2: xlsx đọc dạng chuỗi giữ ô kiểu ngày (bản cache cũ có ngày đã thành chuỗi)
+    return f"parsed/{m.group(1)}/v2_{fmt}_h{file_cfg.get('header_row', 0)}_{kind}.parquet"
+
+def load_parsed(client, bucket: str, key: str) -> pd.DataFrame | None:
+    try:
+        data = get_bytes(client, bucket, key)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    df = pd.read_parquet(io.BytesIO(data))
+    # parquet trả None cho ô trống của cột chuỗi, đọc file gốc thì là NaN -> đổi lại để transform ra cùng kết quả
+    obj_cols = df.select_dtypes(include="object").columns
+    if len(obj_cols):
+        df[obj_cols] = df[obj_cols].where(df[obj_cols].notna(), np.nan)
+    return df
+
+def store_parsed(client, bucket: str, key: str, df: pd.DataFrame):
+    # cột lẫn kiểu (đọc không dtype=str) không ghi parquet được -> bỏ qua cache, không đổi dữ liệu
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        print(f"Không cache được bảng đã parse {key}: {e}")
+        return
+    buf = io.BytesIO(); pq.write_table(table, buf)
+    put_bytes(client, bucket, key, buf.getvalue(), content_type="application/vnd.apache.parquet")
+
+def _parse_raw(client, bucket: str, raw_key: str, file_cfg: dict, fmt: str, dtype, stages: StageTimer) -> pd.DataFrame:
+    # đọc bảng đã parse từ cache nếu có; không thì tải + parse file raw rồi ghi cache
+    cache_key = parse_cache_key(raw_key, file_cfg, fmt, dtype)
+    if cache_key:
+        with stages.stage("parse_cache"):
+            df = load_parsed(client, bucket, cache_key)
+        if df is not None:
+            return df
+    with stages.stage("download"):
+        raw = get_bytes(client, bucket, raw_key)
+    with stages.stage("parse"):
+        df = _read_frame(io.BytesIO(raw), file_cfg, fmt, dtype=dtype)
+    if cache_key:
+        with stages.stage("parse_cache"):
+            store_parsed(client, bucket, cache_key, df)
+    return df
 
+def _timed_chunks(chunks, stages: StageTimer):
+    # stream csv: thời gian lấy chunk kế tiếp = tải từ MinIO + parse
+    it = iter(chunks)
+    while True:
+        with stages.stage("parse"):
+            chunk = next(it, None)
+        if chunk is None:
+            return
+        stages.rows("parsed", len(chunk))
+        yield chunk
+
+def _iter_csv_bytes(chunks, cfg: dict, defaults: dict, stages: StageTimer | None = None):
+    stages = stages or StageTimer("clean")
+    first = True
+    for chunk in chunks:
+        with stages.stage("transform"):
+            data = apply_config(chunk, cfg, defaults).to_csv(index=False, header=first).encode("utf-8")
+        yield data
+        first = False
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    # cột object (chuỗi, hoặc chuỗi lẫn giá trị default) -> string để schema ổn định giữa các chunk
+    obj_cols = df.select_dtypes(include="object").columns
+    if len(obj_cols):
+        df = df.astype({c: "string" for c in obj_cols})
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+class _ByteSink:
+    # output cho ParquetWriter: giữ vị trí tuyệt đối, bytes được lấy ra sau mỗi row group
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+def _iter_parquet_bytes(chunks, cfg: dict, defaults: dict, stages: StageTimer | None = None):
+    stages = stages or StageTimer("clean")
+    sink, writer = _ByteSink(), None
+    for chunk in chunks:
+        with stages.stage("transform"):
+            table = _to_arrow(apply_config(chunk, cfg, defaults, keep_dates=True))
+            if writer is None:
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), table.schema)
+            elif not table.schema.equals(writer.schema, check_metadata=False):
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        # footer parquet
+        writer.close()
+        yield sink.drain()
+
+def staging_key(source: str, raw_name: str, staging_format: str) -> str:
+    if staging_format == "parquet":
+        raw_name = f"{os.path.splitext(raw_name)[0]}.parquet"
+    return f"staging/{source}/cleaned_{raw_name}"
+
+def _load_config(client, cfg: dict | None, cfg_uri: str | None) -> dict:
+    # load config (ưu tiên cfg đã truyền)
+    if cfg is None and cfg_uri:
+        cp = urlparse(cfg_uri)
+        cobj = client.get_object(cp.netloc, cp.path.lstrip("/"))
+        cfg = json.loads(cobj.read().decode("utf-8"))
+        cobj.close(); cobj.release_conn()
+    return cfg or {}
+
+def _log_cleaned(raw_uri: str, cfg_uri: str | None):
     db = SessionLocal()
     try:
         log_ingest(db, source_key="Cleaning", log=f"Cleaned data from {raw_uri} with config {cfg_uri or 'inline'}")
     finally:
         db.close()
 
-    buf = io.BytesIO(); df.to_csv(buf, index=False, encoding="utf-8")
+def _mark_raw_file(raw_uri: str, status: str):
+    db = SessionLocal()
+    try:
+        set_raw_file_status(db, raw_uri, status)
+    finally:
+        db.close()
+
+def clean_data_service(raw_uri: str, *, source: str, cfg: dict | None, cfg_uri: str | None, streaming: bool | None = None) -> str:
+    # trạng thái trong staging.raw_files: upload trùng của file "failed" sẽ được chạy lại
+    with stage_timer("clean") as stages:
+        try:
+            staging_uri = _clean_data(raw_uri, source=source, cfg=cfg, cfg_uri=cfg_uri, streaming=streaming, stages=stages)
+        except Exception:
+            _mark_raw_file(raw_uri, "failed")
+            raise
+    _mark_raw_file(raw_uri, "parsed")
+    return staging_uri
+
+def _clean_data(raw_uri: str, *, source: str, cfg: dict | None, cfg_uri: str | None, streaming: bool | None = None, stages: StageTimer | None = None) -> str:
+    stages = stages or StageTimer("clean")
+    client = make_minio()
+    p = urlparse(raw_uri)
+    with stages.stage("download"):
+        cfg = _load_config(client, cfg, cfg_uri)
+
+    file_cfg = cfg.get("file", {})
+    fmt = (file_cfg.get("format") or "csv").lower()
+    defaults = resolve_defaults(cfg)
     bucket = "pmnm"; ensure_bucket(client, bucket)
-    key = f"staging/{source}/cleaned_{p.path.split('/')[-1]}"
-    return put_bytes(client, bucket, key, buf.getvalue())
+    staging_format = settings.staging_format.lower()
+    as_parquet = staging_format == "parquet"
+    key = staging_key(source, p.path.split('/')[-1], staging_format)
+    content_type = "application/vnd.apache.parquet" if as_parquet else "text/csv"
+    # parquet: cột không khai báo trong "types" giữ dạng chuỗi để schema giống nhau giữa các chunk
+    # (xlsx vẫn giữ ô kiểu ngày, xem _excel_as_str)
+    dtype = str if as_parquet else None
+
+    if streaming is None:
+        streaming = settings.clean_streaming
+    if streaming:
+        # save staging theo từng chunk, upload multipart -> bộ nhớ phụ thuộc chunk, không phụ thuộc file
+        obj = None
+        try:
+            if fmt == "csv" and parse_cache_key(p.path, file_cfg, fmt, dtype) is None:
+                # đọc trực tiếp từ response MinIO, mỗi lần chunk_rows dòng
+                obj = client.get_object(p.netloc, p.path.lstrip("/"))
+                frames = pd.read_csv(CountingReader(obj, p.netloc), chunksize=settings.clean_chunk_rows, dtype=dtype)
+            else:
+                # xlsx/json không đọc theo chunk được (hoặc có cache) -> parse một lần rồi chia nhỏ khi transform
+                frames = _frame_chunks(_parse_raw(client, p.netloc, p.path.lstrip("/"), file_cfg, fmt, dtype, stages), settings.clean_chunk_rows)
+            chunks = _timed_chunks(frames, stages)
+            encode = _iter_parquet_bytes if as_parquet else _iter_csv_bytes
+            stream = IterStream(encode(chunks, cfg, defaults, stages))
+            before = sum(stages.seconds.get(s, 0.0) for s in ("parse", "transform"))
+            start = time.perf_counter()
+            staging_uri = put_stream(client, bucket, key, stream, content_type=content_type, part_size=settings.upload_part_size)
+            # put_stream kéo dữ liệu qua generator: phần thời gian không nằm trong parse/transform là upload
+            spent = sum(stages.seconds.get(s, 0.0) for s in ("parse", "transform")) - before
+            stages.add("upload", time.perf_counter() - start - spent)
+        finally:
+            if obj is not None:
+                obj.close(); obj.release_conn()
+        _log_cleaned(raw_uri, cfg_uri)
+        return staging_uri
+
+    df = _parse_raw(client, p.netloc, p.path.lstrip("/"), file_cfg, fmt, dtype, stages)
+    stages.rows("parsed", len(df))
+    with stages.stage("transform"):
+        df = apply_config(df, cfg, defaults, keep_dates=as_parquet)
+
+    # save staging
+    _log_cleaned(raw_uri, cfg_uri)
+
+    with stages.stage("transform"):
+        buf = io.BytesIO()
+        if as_parquet: pq.write_table(_to_arrow(df), buf)
+        else: df.to_csv(buf, index=False, encoding="utf-8")
+    with stages.stage("upload"):
+        return put_bytes(client, bucket, key, buf.getvalue(), content_type=content_type)
@@ -1,71 +1,58 @@
 # app/workers/services/features.py
-import io, pandas as pd
+import io, time, uuid, pandas as pd
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow.parquet as pq
 from urllib.parse import urlparse
-from app.utils.minio_client import make_minio, put_bytes, ensure_bucket, today_path
-from app.utils.build_facility_id import build_facility_id
+from minio.error import S3Error
+from app.utils.minio_client import make_minio, put_bytes, ensure_bucket, today_path, get_bytes
+from app.utils.build_facility_id import build_facility_ids
 import numpy as np
 from app.db.session import engine
 from sqlalchemy import text
-from app.services.features_service import create_bulk_features
+from app.core.config import settings
+from app.services.features_service import create_bulk_features, replace_feature_lags, source_build_lock
+from app.services.facts_service import upsert_facts
+from app.services.feature_builds_service import build_delay, claim_build, finish_build, get_state_version, set_state_version
+from app.workers.tasks.pipeline_task import retry_features_build
+from app.ml.lags import build_lag_frame
 from app.services.log_service import log_ingest
+from app.services.city_resolver import city_resolver
+from app.core.cache import response_cache
+from app.core.metrics import StageTimer, stage_timer
 from app.db.session import SessionLocal
-from app.models.models import Features # <-- 1. Import model Features
+from app.models.models import Features, FactFacility, FactAttpCertificate, FactCaseProcessing # <-- 1. Import model Features
 
 def to_month(d: pd.Series):
     return pd.to_datetime(d, errors='coerce').dt.to_period('M').astype(str)
 
 NEED_COL = ["ten_co_so", "dia_chi", "quan_huyen", "so_gcn_dkkd", "so_gcn_attp"]
+# Chỉ đọc các cột prepare_frame dùng tới (parquet: các cột khác không được giải nén)
+DATE_COL = ["ngay_cap_gcn_attp", "ngay_tiep_nhan", "thoi_han_gcn_attp", "ngay_cap_moi_nhat", "ngay_cap_dau_tien", "han_tra", "ngay_tra"]
+# cột thông tin cơ sở / giấy chứng nhận / hồ sơ để nạp vào các bảng fact
+FACT_COL = [
+    c.name for t in (FactFacility.__table__, FactAttpCertificate.__table__, FactCaseProcessing.__table__)
+    for c in t.columns if c.name not in ("id", "facility_id", "processing_days", "attp_valid")
+]
+READ_COL = list(dict.fromkeys(NEED_COL + DATE_COL + FACT_COL))
+STAGING_EXT = (".parquet", ".csv")
 
+# Trạng thái incremental: mỗi cơ sở (bản ghi mới nhất) + bảng features theo tháng + các file staging đã gộp vào;
+# mỗi lần build ghi một version mới, feature_builds.state_version trỏ tới version khớp với features đã commit
+STATE_PREFIX = "features_state"
+STATE_COL = ["facility_id", "period_month", "ngay_tiep_nhan", "ngay_cap_gcn_attp", "thoi_han_gcn_attp", "processing_days"]
 
-def build_features_service(staging_uri: str, *, source: str) -> str:
-    m = make_minio()
-    all_dfs = []
-    bucket_name = "pmnm" # Giả sử bucket là 'pmnm'
-    prefix = f"staging/{source}/" # Đường dẫn tới tất cả file clean của source
-
-    # 2. Tải TẤT CẢ các file đã clean của source này
-    try:
-        cleaned_files = m.list_objects(bucket_name, prefix=prefix, recursive=True)
-        for file_obj in cleaned_files:
-            # Đảm bảo chỉ đọc các file csv (tránh các file/thư mục khác)
-            if file_obj.object_name.lower().endswith('.csv'):
-                try:
-                    obj = m.get_object(bucket_name, file_obj.object_name)
-                    df_file = pd.read_csv(io.BytesIO(obj.read()))
-                    obj.close(); obj.release_conn()
-                    all_dfs.append(df_file)
-                except Exception as read_e:
-                    print(f"Bỏ qua file {file_obj.object_name}, lỗi: {read_e}")
-    except Exception as e:
-        print(f"Lỗi khi đọc các file staging cho source {source}: {e}")
-        # Nếu không thể list files, quay lại logic cũ (chỉ xử lý file mới)
-        if not all_dfs:
-            try:
-                p = urlparse(staging_uri)
-                obj = m.get_object(p.netloc, p.path.lstrip("/"))
-                df_file = pd.read_csv(io.BytesIO(obj.read()))
-                obj.close(); obj.release_conn()
-                all_dfs.append(df_file)
-            except Exception as single_e:
-                 print(f"Không thể đọc file staging {staging_uri}: {single_e}")
-                 return f"Không có dữ liệu để xử lý cho {source}"
-
-    if not all_dfs:
-        log_ingest(db, source_key="Features", log=f"Không tìm thấy file staging nào cho source {source} tại prefix {prefix}")
-        return f"Không có dữ liệu file staging cho {source}"
-
-    # 3. Gộp tất cả data lại thành 1 DataFrame
-    df = pd.concat(all_dfs, ignore_index=True)
 
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
     # --- LOGIC TÍNH TOÁN CŨ (GIỮ NGUYÊN) ---
-    # (Chạy logic tính toán, facility_id, v.v. trên df tổng)
-    
-    if "ngay_tiep_nhan" not in df.columns:
+    if "ngay_cap_gcn_attp" in df.columns:
         df['ngay_cap_gcn_attp'] = pd.to_datetime(df['ngay_cap_gcn_attp'], errors='coerce')
+
+    if "ngay_tiep_nhan" not in df.columns:
         df['ngay_tiep_nhan'] = df['ngay_cap_gcn_attp'] - pd.Timedelta(days=60)
-    
+
     if "thoi_han_gcn_attp" not in df.columns:
-        df['thoi_han_gcn_attp'] = pd.to_datetime(df['ngay_cap_gcn_attp'], errors='coerce') + pd.Timedelta(days=1095)
+        df['thoi_han_gcn_attp'] = df['ngay_cap_gcn_attp'] + pd.Timedelta(days=1095)
 
     if "ngay_tiep_nhan" in df.columns:
         base_tra = None
@@ -79,59 +66,382 @@ def build_features_service(staging_uri: str, *, source: str) -> str:
             df["ngay_tiep_nhan"] = pd.to_datetime(df["ngay_tiep_nhan"], errors='coerce')
             base_tra = pd.to_datetime(base_tra, errors='coerce')
             df["processing_days"] = (base_tra - df["ngay_tiep_nhan"]).dt.days
-            
+
     if "han_tra" in df.columns and "ngay_tra" in df.columns:
         df["on_time"] = df["ngay_tra"] <= df["han_tra"]
 
     if "thoi_han_gcn_attp" in df.columns:
-        today = pd.Timestamp.now().normalize()
-        df["thoi_han_gcn_attp"].fillna(pd.to_datetime(df['ngay_cap_gcn_attp'], errors='coerce') + pd.Timedelta(days=1095), inplace=True)
+        df["thoi_han_gcn_attp"] = df["thoi_han_gcn_attp"].fillna(df['ngay_cap_gcn_attp'] + pd.Timedelta(days=1095))
         # Đảm bảo 'thoi_han_gcn_attp' là datetime trước khi so sánh
         df["thoi_han_gcn_attp"] = pd.to_datetime(df["thoi_han_gcn_attp"], errors='coerce')
-        df["attp_valid"] = today <= df["thoi_han_gcn_attp"] 
+        refresh_validity(df)
 
     if "ngay_cap_gcn_attp" in df.columns:
         df["period_month"] = to_month(df["ngay_cap_gcn_attp"])
-    
-    tmp = df[[c for c in NEED_COL if c in df.columns]].copy()
-    fid = tmp.apply(build_facility_id, axis=1)
-    df["facility_id"] = fid
-    
-    # 4. Khử trùng lặp (DE-DUPLICATE) TRÊN TOÀN BỘ DỮ LIỆU
+
+    df["facility_id"] = build_facility_ids(df[[c for c in NEED_COL if c in df.columns]])
+    return df
+
+
+def refresh_validity(df: pd.DataFrame) -> pd.DataFrame:
+    # attp_valid phụ thuộc ngày hiện tại nên tính lại mỗi lần tổng hợp
+    today = pd.Timestamp.now().normalize()
+    df["attp_valid"] = today <= df["thoi_han_gcn_attp"]
+    return df
+
+
+def refresh_month_validity(facilities: pd.DataFrame, months: pd.DataFrame) -> list[str]:
+    # attp_valid_count của mọi tháng (không chỉ tháng có bản ghi mới) đổi theo ngày hiện tại:
+    # tính lại từ state (facilities đã qua refresh_validity), trả về các tháng có số liệu thay đổi
+    valid = facilities.groupby("period_month", dropna=False)["attp_valid"].sum()
+    current = months["period_month"].map(valid).fillna(0).astype(months["attp_valid_count"].dtype)
+    changed = months["attp_valid_count"] != current
+    months.loc[changed, "attp_valid_count"] = current[changed]
+    months.loc[changed, "certified_facility_rate"] = (current / months["facility_count"]).fillna(0)[changed]
+    return sorted(months.loc[changed, "period_month"])
+
+
+def dedup_facilities(df: pd.DataFrame) -> pd.DataFrame:
     # Sắp xếp theo ngày tiếp nhận để giữ lại bản ghi mới nhất
     if "ngay_tiep_nhan" in df.columns:
          df["ngay_tiep_nhan"] = pd.to_datetime(df["ngay_tiep_nhan"], errors='coerce')
-         df = df.sort_values(by="ngay_tiep_nhan", ascending=False)
-           
-    df = df.drop_duplicates(subset=["facility_id"], keep='first') # Giữ bản ghi mới nhất
+         df = df.sort_values(by="ngay_tiep_nhan", ascending=False, kind="stable")
+
+    return df.drop_duplicates(subset=["facility_id"], keep='first') # Giữ bản ghi mới nhất
+
 
-    # 5. Group by và tính toán features (như cũ)
-    out = df.groupby("period_month", dropna=False).agg(
+def group_percentiles(codes: np.ndarray, values, ngroups: int, qs) -> list[np.ndarray]:
+    # percentile "linear" cho mọi nhóm sau một lần sort, bỏ NaN; nội suy đúng công thức của
+    # np.percentile (kể cả nhánh gamma >= 0.5) để kết quả giống hệt bản lambda cũ
+    values = np.asarray(values, dtype="float64")
+    keep = ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    values = values[np.lexsort((values, codes))]
+    counts = np.bincount(codes, minlength=ngroups)
+    has = counts > 0
+    n, starts = counts[has], (np.cumsum(counts) - counts)[has]
+    out = []
+    for q in qs:
+        virtual = (n - 1) * (np.float64(q) / 100)
+        prev = np.floor(virtual)
+        gamma = virtual - prev
+        prev = prev.astype(np.int64)
+        a = values[starts + prev]
+        b = values[starts + np.minimum(prev + 1, n - 1)]
+        diff = b - a
+        r = a + diff * gamma
+        hi = gamma >= 0.5
+        r[hi] = (b - diff * (1 - gamma))[hi]
+        res = np.full(ngroups, np.nan)
+        res[has] = r
+        out.append(res)
+    return out
+
+
+def aggregate_months(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    g = df.groupby("period_month", dropna=False)
+    out = g.agg(
         facility_count=("facility_id","nunique"),
         attp_valid_count=("attp_valid","sum"),
         attp_cert_issued_count=("ngay_cap_gcn_attp", "nunique"),
-        processing_time_p50=("processing_days", lambda s: np.nanpercentile(s.dropna(), 50) if len(s.dropna()) else np.nan),
-        processing_time_p90=("processing_days", lambda s: np.nanpercentile(s.dropna(), 90) if len(s.dropna()) else np.nan ),
     ).reset_index()
+    # ngroup() đánh số nhóm theo đúng thứ tự dòng của agg (sort theo period_month, NaN cuối)
+    p50, p90 = group_percentiles(g.ngroup().to_numpy(), df["processing_days"], len(out), (50, 90))
+    out["processing_time_p50"] = p50
+    out["processing_time_p90"] = p90
     out["certified_facility_rate"] = (out["attp_valid_count"]/out["facility_count"]).fillna(0)
     out["source"] = source
     # Thay thế NaN bằng 0 (hoặc giá trị null thích hợp) thay vì string rỗng
-    out.fillna(0, inplace=True) 
+    out.fillna(0, inplace=True)
+    return out
+
+
+def _state_keys(source: str, version: str) -> tuple[str, str, str]:
+    base = f"{STATE_PREFIX}/{source}/{version}"
+    return f"{base}/facilities.parquet", f"{base}/months.parquet", f"{base}/files.parquet"
+
+
+def load_state(m, bucket: str, source: str, version: str | None, stages: StageTimer | None = None) -> tuple[pd.DataFrame, pd.DataFrame, set[str]] | None:
+    # chưa có version (source mới / state cũ không theo version) -> None: build lại toàn bộ
+    if version is None:
+        return None
+    stages = stages or StageTimer("features")
+    fac_key, month_key, files_key = _state_keys(source, version)
+    try:
+        with stages.stage("download"):
+            fac_raw, month_raw, files_raw = (get_bytes(m, bucket, key) for key in (fac_key, month_key, files_key))
+        with stages.stage("parse"):
+            facilities = pd.read_parquet(io.BytesIO(fac_raw))
+            months = pd.read_parquet(io.BytesIO(month_raw))
+            files = set(pd.read_parquet(io.BytesIO(files_raw))["staging_uri"])
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    return facilities, months, files
+
+
+def save_state(m, bucket: str, source: str, facilities: pd.DataFrame, months: pd.DataFrame, files) -> str:
+    # luôn ghi version mới, không ghi đè state đang dùng -> trả về version để commit con trỏ cùng features
+    version = f"{dt.datetime.utcnow():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+    state = facilities.reindex(columns=STATE_COL)
+    files = pd.DataFrame({"staging_uri": sorted(set(files))})
+    for key, frame in zip(_state_keys(source, version), (state, months, files)):
+        buf = io.BytesIO(); frame.to_parquet(buf, index=False)
+        put_bytes(m, bucket, key, buf.getvalue())
+    return version
+
+
+def drop_state(m, bucket: str, source: str, version: str | None):
+    # version cũ không còn được trỏ tới; lỗi khi xoá chỉ để lại rác, không ảnh hưởng build
+    if version is None:
+        return
+    for key in _state_keys(source, version):
+        try:
+            m.remove_object(bucket, key)
+        except Exception as e:
+            print(f"Không xoá được state cũ {key}: {e}")
+
+
+def merge_state(facilities: pd.DataFrame, new: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    new = dedup_facilities(new).reindex(columns=STATE_COL)
+    replaced = facilities[facilities["facility_id"].isin(new["facility_id"])]
+    # Tháng bị ảnh hưởng: tháng của bản ghi mới + tháng cũ của các cơ sở có bản ghi mới
+    touched = sorted(set(new["period_month"]) | set(replaced["period_month"]))
+    # bản ghi mới đứng trước nên thắng khi trùng ngày tiếp nhận
+    merged = dedup_facilities(pd.concat([new, facilities], ignore_index=True))
+    return merged.reset_index(drop=True), touched
+
+
+def _read_staging(m, bucket: str, key: str, stages: StageTimer) -> pd.DataFrame:
+    # đọc song song từ nhiều thread -> download/parse là tổng thời gian của các thread
+    with stages.stage("download"):
+        raw = io.BytesIO(get_bytes(m, bucket, key))
+    with stages.stage("parse"):
+        if key.lower().endswith(".parquet"):
+            pf = pq.ParquetFile(raw)
+            cols = [c for c in pf.schema_arrow.names if c in READ_COL]
+            return pf.read(columns=cols).to_pandas()
+        # file staging csv cũ vẫn đọc được
+        return pd.read_csv(raw, usecols=lambda c: c in READ_COL)
+
+
+def _fetch_staging(m, bucket: str, key: str, stages: StageTimer):
+    start = time.perf_counter()
+    try:
+        return key, _read_staging(m, bucket, key, stages), time.perf_counter() - start, None
+    except Exception as e:
+        return key, None, time.perf_counter() - start, e
 
+
+def fetch_staging_files(m, bucket: str, keys: list[str], workers: int | None = None, stages: StageTimer | None = None) -> tuple[list[pd.DataFrame], list[str]]:
+    # tải + parse song song; giữ thứ tự của keys để kết quả dedup không phụ thuộc thứ tự tải xong
+    stages = stages or StageTimer("features")
+    workers = max(1, min(workers or settings.features_fetch_workers, len(keys) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="staging-fetch") as pool:
+        results = list(pool.map(lambda key: _fetch_staging(m, bucket, key, stages), keys))
+
+    dfs, timings = [], []
+    for key, df, seconds, err in results:
+        if err is not None:
+            print(f"Bỏ qua file {key}, lỗi: {err}")
+            timings.append(f"{key}: lỗi sau {seconds:.2f}s ({err})")
+            continue
+        dfs.append(df)
+        stages.rows("read", len(df))
+        timings.append(f"{key}: {len(df)} dòng, {seconds:.2f}s")
+    return dfs, timings
+
+
+def _incremental_build(m, bucket: str, staging_uris: list[str], source: str, state, stages: StageTimer | None = None) -> tuple[pd.DataFrame, pd.DataFrame, list[str], list[str], pd.DataFrame | None]:
+    stages = stages or StageTimer("features")
+    facilities, months, _ = state
+    locs = [urlparse(uri) for uri in staging_uris]
+    dfs, timings = [], []
+    for netloc in dict.fromkeys(p.netloc for p in locs):
+        part, t = fetch_staging_files(m, netloc, [p.path.lstrip("/") for p in locs if p.netloc == netloc], stages=stages)
+        dfs += part; timings += t
+    # file staging bị xoá / hỏng: bỏ qua từng file (ghi trong timings) thay vì làm lỗi cả lần build;
+    # build xong thì uri đó cũng ra khỏi danh sách chờ, không kéo theo lỗi cho mọi lần build sau của source
+    if not dfs:
+        return facilities, months, [], timings, None
+    with stages.stage("transform"):
+        # nhiều upload gộp lại: file mới hơn đứng trước để thắng khi trùng ngày tiếp nhận (như khi build lần lượt)
+        new = prepare_frame(pd.concat(dfs[::-1], ignore_index=True))
+        facilities, touched = merge_state(facilities, new)
+
+    with stages.stage("aggregate"):
+        facilities = refresh_validity(facilities)
+        out = aggregate_months(facilities[facilities["period_month"].isin(touched)], source)
+        months = pd.concat([months[~months["period_month"].isin(touched)], out], ignore_index=True)
+        months = months.sort_values("period_month").reset_index(drop=True)
+        # tháng không có bản ghi mới nhưng có giấy chứng nhận hết hạn từ lần build trước -> ghi lại cùng các tháng bị ảnh hưởng
+        touched = sorted(set(touched) | set(refresh_month_validity(facilities, months)))
+    return facilities, months, touched, timings, new
+
+
+def build_features_service(staging_uri: str | list[str], *, source: str, incremental: bool | None = None) -> str:
+    staging_uris = [staging_uri] if isinstance(staging_uri, str) else list(staging_uri)
+    # giữ lock suốt lần build: hai upload cùng source không đọc cùng một state rồi ghi đè lẫn nhau
+    with source_build_lock(source), stage_timer("features") as stages:
+        return _build_features(staging_uris, source=source, incremental=incremental, stages=stages)
+
+
+def pending_build_delay(source: str) -> float:
+    db = SessionLocal()
+    try:
+        return build_delay(db, source, settings.features_quiet_seconds, settings.features_max_delay_seconds)
+    finally:
+        db.close()
+
+
+def build_pending_features_service(source: str, task_id: str) -> str:
+    # build một lần cho mọi upload đang chờ của source (xem request_features_build)
+    with source_build_lock(source):
+        db = SessionLocal()
+        try:
+            staging_uris = claim_build(db, source, task_id)
+            if not staging_uris:
+                return f"Không có upload nào chờ build cho {source}"
+            try:
+                with stage_timer("features") as stages:
+                    result = _build_features(staging_uris, source=source, stages=stages)
+            except Exception as e:
+                failures = finish_build(db, source, task_id, failed=True, error=f"{type(e).__name__}: {e}")
+                try:
+                    retry_features_build(source, task_id, failures)
+                except Exception as retry_error:
+                    # không che lỗi build gốc
+                    print(f"Không hẹn được build lại cho {source}: {retry_error}")
+                raise
+            finish_build(db, source, task_id)
+            return result
+        finally:
+            db.close()
+
+
+def _build_features(staging_uris: list[str], *, source: str, incremental: bool | None = None, stages: StageTimer | None = None) -> str:
+    stages = stages or StageTimer("features")
+    m = make_minio()
+    all_dfs = []
+    bucket_name = "pmnm" # Giả sử bucket là 'pmnm'
+    prefix = f"staging/{source}/" # Đường dẫn tới tất cả file clean của source
+    ensure_bucket(m, bucket_name)
+
+    if incremental is None:
+        incremental = settings.features_incremental
+    db = SessionLocal()
+    try:
+        state_version = get_state_version(db, source)
+    finally:
+        db.close()
+    state = load_state(m, bucket_name, source, state_version, stages) if incremental and staging_uris else None
+    if state is not None and state[2].intersection(staging_uris):
+        # file staging đã có trong state được clean lại tại chỗ (force / config mới): state chỉ giữ bản ghi thắng
+        # của mỗi cơ sở nên không trừ được phần đóng góp cũ của file -> build lại toàn bộ
+        print(f"File staging đã có trong state được build lại cho {source}, build lại toàn bộ")
+        state = None
+
+    if state is not None:
+        # 2a. Incremental: chỉ đọc các file staging mới, tính lại các tháng bị ảnh hưởng
+        df, out, touched, timings, new = _incremental_build(m, bucket_name, staging_uris, source, state, stages)
+        if new is None:
+            db = SessionLocal()
+            try:
+                log_ingest(db, source_key="Features", log=f"Không đọc được file staging nào cho source {source}, bỏ qua: " + "; ".join(timings))
+            finally:
+                db.close()
+            return f"Không có dữ liệu file staging cho {source}"
+        # state chỉ giữ vài cột -> bảng fact lấy từ file mới (upsert theo facility_id)
+        with stages.stage("transform"):
+            facts = dedup_facilities(new)
+        written = out[out["period_month"].isin(touched)]
+        state_files = state[2] | set(staging_uris)
+        files_log = f"{len(staging_uris)} file ({len(touched)} tháng được tính lại)"
+    else:
+        # 2b. Tải TẤT CẢ các file đã clean của source này
+        try:
+            cleaned_files = m.list_objects(bucket_name, prefix=prefix, recursive=True)
+            # Đảm bảo chỉ đọc các file staging parquet/csv (tránh các file/thư mục khác)
+            keys = [o.object_name for o in cleaned_files if o.object_name.lower().endswith(STAGING_EXT)]
+            state_files = [f"s3://{bucket_name}/{k}" for k in keys]
+            all_dfs, timings = fetch_staging_files(m, bucket_name, keys, stages=stages)
+        except Exception as e:
+            print(f"Lỗi khi đọc các file staging cho source {source}: {e}")
+            # Nếu không thể list files, quay lại logic cũ (chỉ xử lý file mới)
+            if not all_dfs and staging_uris:
+                p = urlparse(staging_uris[-1])
+                state_files = staging_uris[-1:]
+                all_dfs, timings = fetch_staging_files(m, p.netloc, [p.path.lstrip("/")], workers=1, stages=stages)
+                if not all_dfs:
+                     return f"Không có dữ liệu để xử lý cho {source}"
+
+        if not all_dfs:
+            db = SessionLocal()
+            try:
+                log_ingest(db, source_key="Features", log=f"Không tìm thấy file staging nào cho source {source} tại prefix {prefix}")
+            finally:
+                db.close()
+            return f"Không có dữ liệu file staging cho {source}"
+
+        with stages.stage("transform"):
+            # 3. Gộp tất cả data lại thành 1 DataFrame
+            df = pd.concat(all_dfs, ignore_index=True)
+            df = prepare_frame(df)
+
+            # 4. Khử trùng lặp (DE-DUPLICATE) TRÊN TOÀN BỘ DỮ LIỆU
+            df = dedup_facilities(df)
+
+        # 5. Group by và tính toán features (như cũ)
+        with stages.stage("aggregate"):
+            out = aggregate_months(df, source)
+        written, touched = out, None
+        facts = df
+        files_log = f"{len(all_dfs)} files"
+
+    with stages.stage("aggregate"):
+        lag_frame = build_lag_frame(out)
+    stages.rows("facilities", len(df))
+    stages.rows("features", len(written))
     buf = io.BytesIO(); out.to_csv(buf, index=False)
-    bucket = "pmnm"; ensure_bucket(m, bucket)
     key = f"features/{source}_{today_path()}.csv" # File này là file tổng hợp cuối cùng
 
     db = SessionLocal()
     try:
-        # 6. Xoá features cũ của source này
-        db.query(Features).filter(Features.source == source).delete(synchronize_session=False)
-        db.commit()
-        
-        # 7. Insert features mới đã được tổng hợp
-        create_bulk_features(db, out.to_dict('records'))
-        
-        log_ingest(db, source_key="Features", log=f"Rebuilt features from {len(all_dfs)} files for source {source}. Total unique facilities: {len(df)}")
+        with stages.stage("upload"):
+            # state + file tổng hợp ghi trước khi commit: lỗi MinIO làm lỗi cả lần build (uri về lại danh sách chờ);
+            # state mới nằm ở version mới, chỉ có hiệu lực khi con trỏ được commit cùng features bên dưới
+            new_version = save_state(m, bucket_name, source, df, out, state_files)
+            features_uri = put_bytes(m, bucket_name, key, buf.getvalue())
+
+        # 6-9 trong một transaction: người đọc thấy features cũ cho tới khi commit, không bao giờ thấy source rỗng;
+        # lỗi giữa chừng thì rollback, dữ liệu cũ còn nguyên
+        with stages.stage("db_write"):
+            # 6. Xoá features cũ của source này (chỉ các tháng bị ảnh hưởng nếu incremental)
+            q = db.query(Features).filter(Features.source == source)
+            if touched is not None:
+                q = q.filter(Features.period_month.in_(touched))
+            deleted = q.delete(synchronize_session=False)
+
+            # 7. Insert features mới đã được tổng hợp
+            create_bulk_features(db, written, commit=False)
+
+            # 8. Cập nhật lag vector của source (dùng cho /ml/predict và train)
+            replace_feature_lags(db, source, lag_frame, commit=False)
+
+            # 9. Nạp / cập nhật các bảng fact (cơ sở, giấy chứng nhận ATTP, hồ sơ)
+            fact_counts = upsert_facts(db, facts, commit=False)
+            set_state_version(db, source, new_version)
+            db.commit()
+        drop_state(m, bucket_name, source, state_version)
+
+        # source mới có thể khớp với các truy vấn thành phố đã cache
+        new_source = touched is None and deleted == 0
+        city_resolver.invalidate(source, new=new_source)
+        # features đã commit -> response /attp/indicators cũ của source không còn đúng
+        response_cache.invalidate(source, new=new_source)
+
+        log_ingest(db, source_key="Features", log=f"Rebuilt features from {files_log} for source {source}. Total unique facilities: {len(df)}. Fact rows: {fact_counts}. Thời gian tải: " + "; ".join(timings))
     except Exception as e:
         db.rollback()
         print(f"Lỗi khi ghi đè features: {e}")
@@ -140,4 +450,4 @@ def build_features_service(staging_uri: str, *, source: str) -> str:
         db.close()
 
     # Trả về URI của file features tổng hợp
-    return put_bytes(m, bucket, key, buf.getvalue())
\ No newline at end of file
+    return features_uri
@@ -1,6 +1,22 @@
+from celery.exceptions import Retry
 from app.core.celery_app import celery
-from app.workers.services.features import build_features_service
+from app.core.profiling import profiled
+from app.workers.services.features import build_features_service, build_pending_features_service, pending_build_delay
+from app.workers.tasks.pipeline_task import request_features_build
 
-@celery.task(name="build_features")
-def build_features(staging_uri: str, source: str) -> str:
-    return build_features_service(staging_uri, source=source)
+@celery.task(name="build_features", bind=True, max_retries=None)
+# lần chạy chỉ hẹn lại (debounce) không có gì để xem -> không lưu profile
+@profiled("build_features", ignore=(Retry,))
+def build_features(self, staging_uri: str | None = None, source: str = "manual") -> str:
+    # có staging_uri: build trực tiếp file đó; không có: build các upload đang chờ của source
+    if staging_uri:
+        return build_features_service(staging_uri, source=source)
+    # debounce: còn upload mới trong quiet window -> hẹn lại (retry giữ nguyên task id)
+    delay = pending_build_delay(source)
+    if delay > 0:
+        raise self.retry(countdown=delay)
+    return build_pending_features_service(source, self.request.id)
+
+@celery.task(name="request_build_features")
+def request_build_features(staging_uri: str, source: str, raw_uri: str | None = None) -> str:
+    return request_features_build(staging_uri, source, raw_uri=raw_uri)
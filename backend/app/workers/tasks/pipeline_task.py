@@ -1,7 +1,58 @@
+import uuid
 from celery import chain, signature
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.feature_builds_service import request_build, request_retry, cancel_request
+from app.services.log_raw_file import move_raw_files_build_task, set_raw_file_build_task
+from app.services.log_service import log_ingest
 
 def run_pipeline_chain(raw_uri: str, source: str, config=None, config_uri=None):
+    # clean_data (queue "clean") -> đánh dấu source cần build; build_features chạy sau khi source "yên"
     return chain(
         signature("clean_data", args=(raw_uri, source, config, config_uri)),
-        signature("build_features", kwargs={"source": source}),
+        signature("request_build_features", kwargs={"source": source, "raw_uri": raw_uri}),
     ).apply_async()
+
+def request_features_build(staging_uri: str, source: str, raw_uri: str | None = None) -> str:
+    # N upload cho cùng source trong một đợt -> chỉ một task build_features đang chờ
+    task_id = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        pending_task_id, created = request_build(db, source, staging_uri, task_id)
+        if created:
+            try:
+                signature("build_features", kwargs={"source": source}).apply_async(
+                    task_id=task_id, countdown=settings.features_quiet_seconds,
+                )
+            except Exception:
+                cancel_request(db, source, task_id)
+                raise
+        # task id của upload -> raw_files.task_id; rebuild sẽ build file này -> raw_files.build_task_id
+        if raw_uri:
+            set_raw_file_build_task(db, raw_uri, pending_task_id)
+        log_ingest(db, source_key="Features", log=f"Queued {staging_uri} for source {source}, build task {pending_task_id}")
+        return pending_task_id
+    finally:
+        db.close()
+
+def retry_features_build(source: str, failed_task_id: str, failures: int) -> str | None:
+    # build lỗi lần thứ failures: build lại sau backoff * 2^(failures - 1) giây, tối đa FEATURES_RETRY_MAX lần liên tiếp;
+    # quá giới hạn thì các uri vẫn chờ (đi cùng upload sau), /upload/task báo "failed"
+    if failures > settings.features_retry_max:
+        return None
+    task_id = uuid.uuid4().hex
+    db = SessionLocal()
+    try:
+        pending_task_id, created = request_retry(db, source, task_id)
+        if created:
+            countdown = settings.features_retry_backoff_seconds * 2 ** (failures - 1)
+            try:
+                signature("build_features", kwargs={"source": source}).apply_async(task_id=task_id, countdown=countdown)
+            except Exception:
+                cancel_request(db, source, task_id)
+                raise
+        move_raw_files_build_task(db, failed_task_id, pending_task_id)
+        log_ingest(db, source_key="Features", log=f"Build {failed_task_id} for source {source} failed ({failures} lần), retry as {pending_task_id}")
+        return pending_task_id
+    finally:
+        db.close()
@@ -0,0 +1,66 @@
+# python -m benchmarks.bench_forest --train-rows 5000 --repeat 200
+import argparse, statistics, tempfile, time, warnings
+import numpy as np
+import pandas as pd
+import mlflow
+from sklearn.ensemble import RandomForestRegressor
+from app.ml.forest import BatchSizedForest, CompiledForest
+from app.ml.lags import feature_names
+
+
+def make_data(rows: int, seed: int = 42) -> tuple[pd.DataFrame, pd.Series]:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.gamma(2.0, 50.0, size=(rows, len(feature_names()))), columns=feature_names())
+    y = 0.6 * X.iloc[:, 0] / (X.iloc[:, 0] + X.iloc[:, 3] + 1) + rng.normal(0, 0.05, rows)
+    return X, y
+
+
+def latency_ms(fn, X, repeat: int) -> float:
+    fn(X)  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(X)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train-rows", type=int, default=5000)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--compiled-max-rows", type=int, default=256, help="như MODEL_COMPILED_MAX_ROWS")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    X, y = make_data(args.train_rows)
+    # giống train.py: n_jobs=-1 (predict của sklearn cũng dispatch qua joblib)
+    model = RandomForestRegressor(n_estimators=args.trees, random_state=42, n_jobs=-1).fit(X, y)
+    compiled = CompiledForest.from_sklearn(model)
+    sized = BatchSizedForest(compiled, model, args.compiled_max_rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mlflow.sklearn.save_model(model, f"{tmp}/model", input_example=X.iloc[:5])
+        pyfunc = mlflow.pyfunc.load_model(f"{tmp}/model")
+
+        # thứ tự cộng của sklearn với n_jobs=1 là thứ tự cây -> phải bằng từng bit
+        model.set_params(n_jobs=1)
+        X_test, _ = make_data(1000, seed=7)
+        assert np.array_equal(model.predict(X_test), compiled.predict(X_test)), "CompiledForest khác sklearn"
+        model.set_params(n_jobs=-1)
+
+        for rows in (1, 100, 300, 1000):
+            batch = X_test.iloc[:rows]
+            times = {
+                "pyfunc": latency_ms(pyfunc.predict, batch, args.repeat),
+                "sklearn": latency_ms(model.predict, batch, args.repeat),
+                "compiled": latency_ms(compiled.predict, batch, args.repeat),
+                "batch_sized": latency_ms(sized.predict, batch, args.repeat),
+            }
+            print(f"rows={rows:<5} " + "  ".join(f"{k}={v:.3f}ms" for k, v in times.items())
+                  + f"  speedup vs pyfunc={times['pyfunc'] / times['compiled']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
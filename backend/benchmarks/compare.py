@@ -0,0 +1,42 @@
+# python -m benchmarks.compare benchmarks/results/<cũ>.json benchmarks/results/<mới>.json --threshold 1.2
+import argparse, json, sys
+
+
+def _key(entry: dict) -> tuple:
+    return entry["stage"], entry.get("format"), entry["rows"], entry.get("engine")
+
+
+def load(path: str) -> tuple[dict, dict]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data["meta"], {_key(e): e for e in data["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh hai file kết quả của benchmarks.run")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2, help="new/base lớn hơn ngưỡng này thì coi là chậm đi")
+    args = parser.parse_args()
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print(f"base={base_meta.get('commit')} ({base_meta.get('timestamp')})  new={new_meta.get('commit')} ({new_meta.get('timestamp')})")
+
+    regressions = 0
+    for key in sorted(base.keys() & new.keys(), key=lambda k: (k[2], str(k[1]), k[0], str(k[3]))):
+        stage, fmt, rows, engine = key
+        b, n = base[key]["seconds"], new[key]["seconds"]
+        ratio = n / b if b else float("inf")
+        flag = ""
+        if ratio > args.threshold:
+            flag, regressions = "  <-- chậm hơn", regressions + 1
+        name = stage + (f"[{engine}]" if engine else "")
+        print(f"{name:<36} {fmt or '-':<5} rows={rows:<9,} {b:9.4f}s -> {n:9.4f}s  x{ratio:5.2f}{flag}")
+    for key in sorted(new.keys() - base.keys(), key=str):
+        print(f"(mới) {key}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# python -m benchmarks.dataset --rows 100000 --format xlsx --out /tmp/attp_100k.xlsx
+import argparse, io
+import numpy as np
+import pandas as pd
+
+# header giống file gốc (hoa/thường, dấu cách, "Đ"): normalize_columns của cleaning đưa về đúng tên cột NEED_COL/DATE_COL
+HEADERS = {
+    "stt": "STT",
+    "so_bien_nhan": "So bien nhan",
+    "linh_vuc": "Linh vuc",
+    "ten_co_so": "Ten co so",
+    "ten_chu_co_so": "Ten chu co so",
+    "ten_dai_dien": "Ten đai dien",
+    "dia_chi": "Đia chi",
+    "phuong_xa": "Phuong xa",
+    "quan_huyen": "Quan huyen",
+    "tinh_thanh": "Tinh thanh",
+    "dien_thoai": "Đien thoai",
+    "loai_hinh_co_so": "Loai hinh co so",
+    "so_gcn_dkkd": "So GCN ĐKKD",
+    "ngay_cap_dkkd": "Ngay cap ĐKKD",
+    "so_gcn_attp": "So GCN ATTP",
+    "ngay_tiep_nhan": "Ngay tiep nhan",
+    "han_tra": "Han tra",
+    "ngay_tra": "Ngay tra",
+    "ngay_cap_gcn_attp": "Ngay cap GCN ATTP",
+    "thoi_han_gcn_attp": "Thoi han GCN ATTP",
+    "ket_qua": "Ket qua",
+    "chuyen_vien_thu_ly": "Chuyen vien thu ly",
+}
+DATE_FORMAT = "%d/%m/%Y"
+DATE_COLS = ["ngay_cap_dkkd", "ngay_tiep_nhan", "han_tra", "ngay_tra", "ngay_cap_gcn_attp", "thoi_han_gcn_attp"]
+
+# config upload tương ứng (cùng dạng file config gửi kèm /upload/data)
+CLEAN_CONFIG = {
+    "file": {"format": "csv", "header_row": 0},
+    "types": {**{c: f"date:{DATE_FORMAT}" for c in DATE_COLS}, "stt": "int", "so_gcn_dkkd": "str", "so_gcn_attp": "str"},
+    "defaults": {"tinh_thanh": "Da Nang"},
+    "transforms": [{"op": "strip", "cols": ["ten_co_so", "dia_chi"]}],
+}
+
+WARDS = {
+    "Hải Châu": ["Thạch Thang", "Hải Châu 1", "Phước Ninh", "Bình Hiên", "Hòa Cường Bắc"],
+    "Thanh Khê": ["Tam Thuận", "Thanh Khê Tây", "Xuân Hà", "Chính Gián"],
+    "Sơn Trà": ["An Hải Bắc", "Mân Thái", "Phước Mỹ", "Thọ Quang"],
+    "Ngũ Hành Sơn": ["Mỹ An", "Khuê Mỹ", "Hòa Hải"],
+    "Liên Chiểu": ["Hòa Khánh Bắc", "Hòa Minh", "Hòa Hiệp Nam"],
+    "Cẩm Lệ": ["Hòa Thọ Đông", "Khuê Trung", "Hòa Xuân"],
+    "Hòa Vang": ["Hòa Tiến", "Hòa Phong", "Hòa Liên"],
+}
+KINDS = ["Dịch vụ ăn uống", "Sản xuất chả heo, bò", "SX bún", "Kinh doanh thực phẩm", "Bếp ăn tập thể", "Ăn uống giải khát"]
+STREETS = ["Lê Duẩn", "Hùng Vương", "Nguyễn Văn Linh", "Bạch Đằng", "Trần Phú", "Ông Ích Khiêm", "Hoàng Diệu", "Ngô Quyền"]
+NAMES = ["Nguyễn Văn", "Trần Thị", "Lê Hoài", "Phạm Minh", "Huỳnh Thị", "Võ Thanh", "Đặng Quốc"]
+EPOCH = pd.Timestamp("2015-01-01")
+
+
+def _pick(rng, values, n) -> np.ndarray:
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+
+def _dates(days: np.ndarray) -> np.ndarray:
+    # format trước một lần cho mỗi ngày có thể có, rồi tra bảng (nhanh hơn strftime từng dòng)
+    table = (EPOCH + pd.to_timedelta(np.arange(days.max() + 1), unit="D")).strftime(DATE_FORMAT).to_numpy(dtype=object)
+    return table[days]
+
+
+def generate(rows: int, dup_rate: float = 0.1, missing_id_rate: float = 0.3, seed: int = 42,
+             days: int = 365 * 10, offset_days: int = 0) -> pd.DataFrame:
+    # rows dòng hồ sơ ATTP; dup_rate: tỉ lệ dòng là hồ sơ mới (cấp lại/gia hạn) của cơ sở đã có ở dòng khác;
+    # ngày tiếp nhận rải đều trong [EPOCH + offset_days, EPOCH + offset_days + days)
+    rng = np.random.default_rng(seed)
+    n_fac = max(1, int(round(rows * (1 - dup_rate))))
+    # dòng đầu của mỗi cơ sở + các dòng lặp lại trỏ về cơ sở ngẫu nhiên, xáo trộn thứ tự
+    fac = np.concatenate([np.arange(n_fac), rng.integers(0, n_fac, rows - n_fac)])
+    fac = fac[rng.permutation(rows)]
+
+    districts = np.array(list(WARDS), dtype=object)
+    fac_district = rng.integers(0, len(districts), n_fac)
+    fac_ward = np.array([WARDS[d][i % len(WARDS[d])] for d, i in zip(districts[fac_district], rng.integers(0, 5, n_fac))], dtype=object)
+    fac_name = pd.Series(_pick(rng, KINDS, n_fac)) + " " + pd.Series(np.arange(n_fac)).astype(str)
+    fac_addr = pd.Series(rng.integers(1, 999, n_fac)).astype(str) + " " + pd.Series(_pick(rng, STREETS, n_fac))
+    fac_owner = pd.Series(_pick(rng, NAMES, n_fac)) + " " + pd.Series(rng.integers(1, 9999, n_fac)).astype(str)
+    fac_dkkd = ("32A" + pd.Series(np.arange(n_fac) + 8_000_000).astype(str)).to_numpy(dtype=object)
+    # cơ sở không có số ĐKKD -> facility_id dựa vào số GCN ATTP hoặc tên + địa chỉ
+    fac_dkkd[rng.random(n_fac) < missing_id_rate] = None
+    fac_phone = ("09" + pd.Series(rng.integers(10_000_000, 99_999_999, n_fac)).astype(str)).to_numpy(dtype=object)
+
+    received = offset_days + rng.integers(0, days, rows)
+    processing = rng.integers(3, 90, rows)
+    issued = received + processing
+    certified = rng.random(rows) < 0.85
+
+    df = pd.DataFrame({
+        "stt": np.arange(1, rows + 1),
+        "so_bien_nhan": (4_042_000_000 + np.arange(rows)).astype(str),
+        "linh_vuc": _pick(rng, ["YT", "CT", "NN"], rows),
+        # vài tên/địa chỉ có khoảng trắng thừa cho transform "strip"
+        "ten_co_so": np.where(rng.random(rows) < 0.05, " " + fac_name.to_numpy(dtype=object)[fac] + " ", fac_name.to_numpy(dtype=object)[fac]),
+        "ten_chu_co_so": fac_owner.to_numpy(dtype=object)[fac],
+        "ten_dai_dien": fac_owner.to_numpy(dtype=object)[fac],
+        "dia_chi": fac_addr.to_numpy(dtype=object)[fac],
+        "phuong_xa": fac_ward[fac],
+        "quan_huyen": districts[fac_district][fac],
+        "tinh_thanh": np.where(rng.random(rows) < 0.1, None, "Da Nang"),
+        "dien_thoai": fac_phone[fac],
+        "loai_hinh_co_so": _pick(rng, KINDS, rows),
+        "so_gcn_dkkd": fac_dkkd[fac],
+        "ngay_cap_dkkd": _dates(np.maximum(received - rng.integers(30, 720, rows), 0)),
+        "so_gcn_attp": np.where(certified, pd.Series(np.arange(rows)).astype(str).to_numpy(dtype=object) + "/ATTP-CNĐK", None),
+        "ngay_tiep_nhan": _dates(received),
+        "han_tra": _dates(received + 30),
+        "ngay_tra": _dates(issued),
+        "ngay_cap_gcn_attp": np.where(certified, _dates(issued), None),
+        "thoi_han_gcn_attp": np.where(certified & (rng.random(rows) < 0.9), _dates(issued + 3 * 365), None),
+        "ket_qua": np.where(certified, "Đạt", "Không đạt"),
+        "chuyen_vien_thu_ly": _pick(rng, NAMES, rows),
+    })
+    return df.rename(columns=HEADERS)
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def to_xlsx_bytes(df: pd.DataFrame, native_dates: bool = False) -> bytes:
+    # native_dates: cột ngày ghi thành ô kiểu ngày của Excel (như file xuất từ phần mềm), không phải chuỗi dd/mm/yyyy
+    if native_dates:
+        df = df.copy()
+        for col in DATE_COLS:
+            df[HEADERS[col]] = pd.to_datetime(df[HEADERS[col]], format=DATE_FORMAT)
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def file_ext(fmt: str) -> str:
+    return "xlsx" if fmt.startswith("xlsx") else fmt
+
+
+def to_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    # fmt: csv | xlsx | xlsx_dates (xlsx có ô kiểu ngày)
+    if fmt.startswith("xlsx"):
+        return to_xlsx_bytes(df, native_dates=fmt == "xlsx_dates")
+    return to_csv_bytes(df)
+
+
+def config_for(fmt: str) -> dict:
+    return {**CLEAN_CONFIG, "file": {**CLEAN_CONFIG["file"], "format": file_ext(fmt)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh file ATTP giả lập (cố định theo seed)")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dup-rate", type=float, default=0.1)
+    parser.add_argument("--missing-id-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--format", choices=["csv", "xlsx", "xlsx_dates"], default="csv")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    df = generate(args.rows, args.dup_rate, args.missing_id_rate, args.seed)
+    with open(args.out, "wb") as f:
+        f.write(to_bytes(df, args.format))
+    print(f"{args.out}: {len(df):,} dòng, {df[HEADERS['so_gcn_dkkd']].nunique():,} số ĐKKD")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# python -m benchmarks.run --rows 10000 100000 1000000 --formats csv xlsx
+# Chạy offline: MinIO được thay bằng benchmarks.storage (bộ nhớ hoặc thư mục local), không ghi DB.
+# Vẫn cần DATABASE_URL hợp lệ về cú pháp vì app.db.session tạo engine lúc import (không kết nối).
+import argparse, contextlib, datetime as dt, hashlib, io, json, os, platform, statistics, subprocess, time, warnings
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sklearn.ensemble import RandomForestRegressor
+from app.core.config import settings
+from app.core.metrics import StageTimer
+from app.ml.forest import CompiledForest
+from app.ml.lags import build_lag_frame, feature_names, training_frame
+from app.ml.prediction import _predict
+from app.utils.build_facility_id import build_facility_ids
+from app.workers.services import cleaning, features
+from app.workers.services.features import (
+    NEED_COL, STAGING_EXT, aggregate_months, dedup_facilities, fetch_staging_files, load_state, prepare_frame, save_state,
+    _incremental_build,
+)
+from benchmarks.dataset import HEADERS, config_for, file_ext, generate, to_bytes
+from benchmarks.storage import make_store
+
+BUCKET = "pmnm"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+@contextlib.contextmanager
+def offline(store):
+    # các service gọi make_minio() và ghi log / trạng thái raw_files vào DB -> thay bằng store và no-op
+    patches = [
+        (cleaning, "make_minio", lambda: store),
+        (features, "make_minio", lambda: store),
+        (cleaning, "_log_cleaned", lambda *args, **kwargs: None),
+        (cleaning, "_mark_raw_file", lambda *args, **kwargs: None),
+    ]
+    saved = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    for mod, name, value in patches:
+        setattr(mod, name, value)
+    try:
+        yield store
+    finally:
+        for mod, name, value in saved:
+            setattr(mod, name, value)
+
+
+def timed(fn, repeat: int = 1):
+    # best-of-N: ít nhiễu hơn trung bình khi máy còn việc khác
+    samples, out = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        samples.append(time.perf_counter() - start)
+    return out, min(samples), samples
+
+
+class Recorder:
+    def __init__(self):
+        self.results = []
+
+    def add(self, stage: str, rows: int, fmt: str | None, seconds: float, samples=None, **extra):
+        entry = {
+            "stage": stage, "rows": rows, "format": fmt, "seconds": round(seconds, 6),
+            "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        }
+        if samples and len(samples) > 1:
+            entry["samples"] = [round(s, 6) for s in samples]
+        entry.update(extra)
+        self.results.append(entry)
+        print(f"{stage:<28} rows={rows:<9,} fmt={fmt or '-':<5} {seconds:8.3f}s" + (f"  {extra}" if extra else ""))
+
+
+def drop_parse_cache(store):
+    for key in store._keys(BUCKET):
+        if key.startswith("parsed/"):
+            store.remove_object(BUCKET, key)
+
+
+def staging_keys(store, source: str) -> list[str]:
+    return [o.object_name for o in store.list_objects(BUCKET, prefix=f"staging/{source}/", recursive=True)
+            if o.object_name.lower().endswith(STAGING_EXT)]
+
+
+# con trỏ version state theo source (thay cho feature_builds.state_version, benchmark không có DB)
+STATE_VERSIONS: dict[str, str] = {}
+
+
+def features_full(store, source: str, stages: StageTimer) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # nhánh rebuild toàn bộ của _build_features, bỏ phần ghi DB
+    keys = staging_keys(store, source)
+    dfs, _ = fetch_staging_files(store, BUCKET, keys, stages=stages)
+    with stages.stage("transform"):
+        df = dedup_facilities(prepare_frame(pd.concat(dfs, ignore_index=True)))
+    with stages.stage("aggregate"):
+        out = aggregate_months(df, source)
+        build_lag_frame(out)
+    with stages.stage("upload"):
+        STATE_VERSIONS[source] = save_state(store, BUCKET, source, df, out, [f"s3://{BUCKET}/{k}" for k in keys])
+    return df, out
+
+
+def features_incremental(store, staging_uri: str, source: str, stages: StageTimer):
+    state = load_state(store, BUCKET, source, STATE_VERSIONS.get(source), stages)
+    facilities, months, touched, _, new = _incremental_build(store, BUCKET, [staging_uri], source, state, stages)
+    with stages.stage("aggregate"):
+        build_lag_frame(months)
+    with stages.stage("upload"):
+        STATE_VERSIONS[source] = save_state(store, BUCKET, source, facilities, months, state[2] | {staging_uri})
+    return touched
+
+
+def prediction_inputs(df: pd.DataFrame, trees: int) -> tuple[RandomForestRegressor, pd.DataFrame]:
+    # mỗi quận một source -> lag theo tháng -> RF nhỏ; input là lag vector mới nhất của từng source
+    lags = pd.concat([build_lag_frame(aggregate_months(g, str(district))) for district, g in df.groupby("quan_huyen")], ignore_index=True)
+    train = training_frame(lags)
+    model = RandomForestRegressor(n_estimators=trees, random_state=42, n_jobs=1).fit(train[feature_names()], train["certified_facility_rate"])
+    latest = lags.groupby("source").tail(1)[feature_names()].reset_index(drop=True)
+    return model, latest
+
+
+def median_ms(fn, repeat: int) -> float:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run_case(rec: Recorder, store, rows: int, fmt: str, args):
+    source = f"bench_{fmt}_{rows}"
+    frame, seconds, _ = timed(lambda: generate(rows, args.dup_rate, args.missing_id_rate, args.seed))
+    rec.add("generate", rows, fmt, seconds)
+    data, seconds, _ = timed(lambda: to_bytes(frame, fmt))
+    rec.add("encode_raw", rows, fmt, seconds, bytes=len(data))
+    # key có checksum như upload thật -> parse cache (parsed/{md5}/...) áp dụng được
+    raw_key = f"raw/{source}/{dt.date.today():%Y-%m-%d}/{hashlib.md5(data).hexdigest()}_{rows}.{file_ext(fmt)}"
+    store.put_object(BUCKET, raw_key, io.BytesIO(data), len(data))
+    raw_uri = f"s3://{BUCKET}/{raw_key}"
+
+    def clean(streaming: bool, stages: StageTimer, cold: bool = True):
+        if cold:
+            drop_parse_cache(store)
+        return cleaning._clean_data(raw_uri, source=source, cfg=config_for(fmt), cfg_uri=None, streaming=streaming, stages=stages)
+
+    for streaming in (True, False):
+        stages = StageTimer("clean")
+        _, seconds, samples = timed(lambda: clean(streaming, stages), args.repeat)
+        rec.add("clean_stream" if streaming else "clean", rows, fmt, seconds, samples, stages=_rounded(stages.seconds, args.repeat))
+    if any(k.startswith("parsed/") for k in store._keys(BUCKET)):
+        # retry / clean lại với config khác: bảng raw đã parse nằm sẵn trong cache
+        stages = StageTimer("clean")
+        _, seconds, samples = timed(lambda: clean(False, stages, cold=False), args.repeat)
+        rec.add("clean_cached", rows, fmt, seconds, samples, stages=_rounded(stages.seconds, args.repeat))
+
+    staging = fetch_staging_files(store, BUCKET, staging_keys(store, source))[0][0]
+    # ngày cấp mất khi clean (vd. ô ngày Excel đọc thành chuỗi rồi parse sai format) -> số đo không còn ý nghĩa
+    expected, parsed = int(frame[HEADERS["ngay_cap_gcn_attp"]].notna().sum()), int(staging["ngay_cap_gcn_attp"].notna().sum())
+    if parsed != expected:
+        raise RuntimeError(f"{source}: ngay_cap_gcn_attp còn {parsed:,}/{expected:,} giá trị sau clean")
+    _, seconds, samples = timed(lambda: build_facility_ids(staging[[c for c in NEED_COL if c in staging.columns]]), args.repeat)
+    rec.add("build_facility_id", rows, fmt, seconds, samples)
+
+    stages = StageTimer("features")
+    (df, out), seconds, samples = timed(lambda: features_full(store, source, stages), args.repeat)
+    rec.add("build_features_full", rows, fmt, seconds, samples, stages=_rounded(stages.seconds, args.repeat),
+            facilities=len(df), months=len(out))
+
+    # upload tiếp theo của cùng source: args.update_rate * rows dòng của 3 tháng gần nhất, một phần trùng cơ sở đã có
+    update_rows = max(1, int(rows * args.update_rate))
+    update = to_bytes(generate(update_rows, args.dup_rate, args.missing_id_rate, args.seed + 1, days=90, offset_days=365 * 10 - 90), fmt)
+    update_key = f"raw/{source}/{dt.date.today():%Y-%m-%d}/{rows}_update.{file_ext(fmt)}"
+    store.put_object(BUCKET, update_key, io.BytesIO(update), len(update))
+    update_uri = cleaning._clean_data(f"s3://{BUCKET}/{update_key}", source=source, cfg=config_for(fmt), cfg_uri=None)
+    stages = StageTimer("features")
+    # chỉ đo một lần: chạy lại thì state đã chứa upload này
+    touched, seconds, _ = timed(lambda: features_incremental(store, update_uri, source, stages))
+    rec.add("build_features_incremental", update_rows, fmt, seconds, stages=_rounded(stages.seconds, 1),
+            base_rows=rows, touched_months=len(touched))
+
+    if fmt == args.formats[0]:
+        model, latest = prediction_inputs(df, args.trees)
+        compiled = CompiledForest.from_sklearn(model)
+        one = latest.iloc[:1]
+        rec.add("make_prediction", 1, None, median_ms(lambda: _predict(model, one), args.predict_repeat) / 1000,
+                engine="sklearn", base_rows=rows)
+        rec.add("make_prediction", 1, None, median_ms(lambda: _predict(compiled, one), args.predict_repeat) / 1000,
+                engine="compiled", base_rows=rows)
+        # batch: so cả hai engine, ngưỡng MODEL_COMPILED_MAX_ROWS chọn theo kết quả này
+        rec.add("make_prediction_batch", len(latest), None, median_ms(lambda: _predict(model, latest, kind="batch"), args.predict_repeat) / 1000,
+                engine="sklearn", base_rows=rows)
+        rec.add("make_prediction_batch", len(latest), None, median_ms(lambda: _predict(compiled, latest, kind="batch"), args.predict_repeat) / 1000,
+                engine="compiled", base_rows=rows)
+
+
+def _rounded(seconds: dict, repeat: int) -> dict:
+    # StageTimer cộng dồn qua các lần lặp -> chia trung bình mỗi lần
+    return {name: round(s / repeat, 6) for name, s in seconds.items()}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def metadata(args) -> dict:
+    return {
+        "commit": _git_commit(),
+        "timestamp": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": {"pandas": pd.__version__, "numpy": np.__version__, "pyarrow": pa.__version__},
+        "settings": {
+            "staging_format": settings.staging_format, "clean_chunk_rows": settings.clean_chunk_rows,
+            "parse_cache": settings.parse_cache, "parse_cache_formats": settings.parse_cache_formats,
+            "excel_engine": cleaning.excel_engine() or "default",
+        },
+        "args": {k: v for k, v in vars(args).items() if k != "out"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark từng bước pipeline ATTP trên dữ liệu giả lập")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--formats", nargs="+", choices=["csv", "xlsx", "xlsx_dates"], default=["csv", "xlsx", "xlsx_dates"])
+    # ghi/đọc xlsx 1M dòng bằng openpyxl mất rất lâu -> mặc định chỉ chạy xlsx tới 100k dòng
+    parser.add_argument("--xlsx-max-rows", type=int, default=100_000)
+    parser.add_argument("--dup-rate", type=float, default=0.1)
+    parser.add_argument("--missing-id-rate", type=float, default=0.3)
+    parser.add_argument("--update-rate", type=float, default=0.05, help="kích thước upload tiếp theo (incremental), theo tỉ lệ rows")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--predict-repeat", type=int, default=200)
+    parser.add_argument("--backend", default="memory", help="memory | local:<thư mục>")
+    parser.add_argument("--out", help="file JSON kết quả (mặc định benchmarks/results/<commit>_<thời gian>.json)")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    rec = Recorder()
+    for rows in args.rows:
+        for fmt in args.formats:
+            if fmt.startswith("xlsx") and rows > args.xlsx_max_rows:
+                print(f"bỏ qua {fmt} {rows:,} dòng (> --xlsx-max-rows)")
+                continue
+            # mỗi trường hợp một store mới: build toàn bộ chỉ thấy file staging của chính nó
+            with offline(make_store(args.backend)) as store:
+                store.make_bucket(BUCKET)
+                run_case(rec, store, rows, fmt, args)
+
+    meta = metadata(args)
+    out = args.out or os.path.join(RESULTS_DIR, f"{meta['commit'] or 'local'}_{dt.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": rec.results}, f, ensure_ascii=False, indent=2)
+    print(f"-> {out}")
+
+
+if __name__ == "__main__":
+    main()
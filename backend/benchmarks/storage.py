@@ -0,0 +1,123 @@
+import io, os
+from types import SimpleNamespace
+from minio.error import S3Error
+
+
+class _Response:
+    # giống response của Minio.get_object ở những gì pipeline dùng
+    def __init__(self, data: bytes):
+        self._buf = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._buf.read(-1 if amt is None else amt)
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class MemoryMinio:
+    # thay cho Minio client khi benchmark offline: object nằm trong dict {(bucket, key): bytes}
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.buckets: set[str] = set()
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise S3Error("NoSuchKey", "Object does not exist", key, None, None, None, bucket, key)
+
+    def _put(self, bucket: str, key: str, data: bytes):
+        self.objects[(bucket, key)] = data
+
+    def _keys(self, bucket: str) -> list[str]:
+        return sorted(k for b, k in self.objects if b == bucket)
+
+    def _remove(self, bucket: str, key: str):
+        self.objects.pop((bucket, key), None)
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return bucket in self.buckets
+
+    def make_bucket(self, bucket: str):
+        self.buckets.add(bucket)
+
+    def put_object(self, bucket: str, key: str, data, length: int, part_size: int = 0, content_type: str | None = None):
+        if length < 0:
+            # multipart: đọc từng part như client thật
+            parts = []
+            while True:
+                part = data.read(part_size)
+                if not part:
+                    break
+                parts.append(part)
+            self._put(bucket, key, b"".join(parts))
+        else:
+            self._put(bucket, key, data.read(length))
+
+    def get_object(self, bucket: str, key: str) -> _Response:
+        return _Response(self._get(bucket, key))
+
+    def stat_object(self, bucket: str, key: str):
+        return SimpleNamespace(bucket_name=bucket, object_name=key, size=len(self._get(bucket, key)))
+
+    def list_objects(self, bucket: str, prefix: str | None = None, recursive: bool = False):
+        return [SimpleNamespace(object_name=k, size=None) for k in self._keys(bucket) if k.startswith(prefix or "")]
+
+    def copy_object(self, bucket: str, key: str, source):
+        self._put(bucket, key, self._get(source.bucket_name, source.object_name))
+
+    def remove_object(self, bucket: str, key: str):
+        self._remove(bucket, key)
+
+
+class LocalMinio(MemoryMinio):
+    # như MemoryMinio nhưng object là file dưới root/{bucket}/{key} (giữ lại được giữa các lần chạy)
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        try:
+            with open(self._path(bucket, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise S3Error("NoSuchKey", "Object does not exist", key, None, None, None, bucket, key)
+
+    def _put(self, bucket: str, key: str, data: bytes):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _keys(self, bucket: str) -> list[str]:
+        base = os.path.join(self.root, bucket)
+        keys = []
+        for dirpath, _, files in os.walk(base):
+            keys += [os.path.relpath(os.path.join(dirpath, f), base).replace(os.sep, "/") for f in files]
+        return sorted(keys)
+
+    def _remove(self, bucket: str, key: str):
+        try:
+            os.remove(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return os.path.isdir(os.path.join(self.root, bucket))
+
+    def make_bucket(self, bucket: str):
+        os.makedirs(os.path.join(self.root, bucket), exist_ok=True)
+
+
+def make_store(backend: str):
+    # "memory" hoặc "local:<thư mục>"
+    if backend.startswith("local:"):
+        return LocalMinio(backend.split(":", 1)[1])
+    return MemoryMinio()
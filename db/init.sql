@@ -44,6 +44,34 @@ CREATE TABLE IF NOT EXISTS core.ingest_logs (
   log text not null
 );
 
+-- rebuild features đang chờ theo source: nhiều upload liên tiếp chỉ tạo một task build_features
+create table if not exists core.feature_builds (
+	source text primary key,
+	pending_task_id text,
+	pending_uris text[] not null default '{}',
+	running_task_id text,
+	running_uris text[] not null default '{}',
+	requested_at timestamptz default now(),  -- upload gần nhất (tính quiet window)
+	dirty_since timestamptz,                 -- upload đầu tiên chưa được build (tính max delay)
+	failed_task_id text,                     -- task build lỗi gần nhất (GET /upload/task báo "failed")
+	failures integer not null default 0,     -- số lần lỗi liên tiếp (giới hạn số lần tự build lại)
+	last_error text,
+	state_version text                       -- version state incremental (features_state/<source>/<version>/) khớp với features đã commit
+);
+
+-- file raw đã upload; checksum dùng để bỏ qua upload trùng
+create table if not exists staging.raw_files (
+	id bigserial primary key,
+	path text not null,
+	source_id integer references core.sources(id),
+	checksum text,
+	ingested_at timestamptz default now(),
+	status text check (status in ('new','parsed','failed')),
+	task_id text,
+	build_task_id text,  -- task build_features (đã debounce) sẽ/đã build file này
+	constraint checksum_unique unique (checksum)
+);
+
 create schema if not exists warehouse;
 
 create table warehouse.fact_facility (
@@ -102,4 +130,36 @@ create table warehouse.features (
 	processing_time_p90 float,
 	certified_facility_rate float,
 	source text
-);
\ No newline at end of file
+);
+
+-- tra cứu thành phố theo độ tương đồng (toán tử `%` dùng được GIN index)
+create extension if not exists pg_trgm;
+
+create index if not exists idx_features_source_trgm on warehouse.features using gin (source gin_trgm_ops);
+create index if not exists idx_features_source on warehouse.features(source);
+
+-- lag vector theo (source, tháng): lag1 = tháng đó; dòng mới nhất của source là input cho /ml/predict
+create table if not exists warehouse.feature_lags (
+	source text not null,
+	period_month text not null,
+	attp_cert_issued_count_lag1 float,
+	attp_cert_issued_count_lag2 float,
+	attp_cert_issued_count_lag3 float,
+	attp_valid_count_lag1 float,
+	attp_valid_count_lag2 float,
+	attp_valid_count_lag3 float,
+	processing_time_p50_lag1 float,
+	processing_time_p50_lag2 float,
+	processing_time_p50_lag3 float,
+	processing_time_p90_lag1 float,
+	processing_time_p90_lag2 float,
+	processing_time_p90_lag3 float,
+	facility_count_lag1 float,
+	facility_count_lag2 float,
+	facility_count_lag3 float,
+	certified_facility_rate_lag1 float,
+	certified_facility_rate_lag2 float,
+	certified_facility_rate_lag3 float,
+	updated_at timestamptz default now(),
+	primary key (source, period_month)
+);